@@ -0,0 +1,151 @@
+# standard library
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from datetime import datetime
+from threading import Lock
+
+# project
+from cache import LRUCache
+from config import app, db, SERVER_TIMEZONE
+from models import Transaction, Van
+
+
+class BookedIntervals:
+    # the booked periods of a van as sorted, merged, half-open [commencement, expiration) date ranges;
+    # a rent ends on the morning of its expiration day, so the next one may commence on that very day
+    #
+    # since the ranges never overlap, both `starts` and `ends` are sorted: lookups are binary searches
+
+    def __init__(self, periods=()):
+        self.starts = []
+        self.ends = []
+        for start, end in sorted(periods):
+            self.add(start, end)
+
+    def add(self, start, end):
+        if start >= end:
+            return None  # an empty period books nothing
+        # the ranges touching [start, end) are merged into it
+        low = bisect_left(self.ends, start)
+        high = bisect_right(self.starts, end)
+        if low < high:
+            start = min(start, self.starts[low])
+            end = max(end, self.ends[high - 1])
+        self.starts[low:high] = [start]
+        self.ends[low:high] = [end]
+
+    def overlaps(self, start, end):
+        # O(log n): only the last range commencing before `end` may reach into [start, end)
+        index = bisect_left(self.starts, end) - 1
+        return start < end and index >= 0 and self.ends[index] > start
+
+    def busy(self, start, end):
+        # the booked ranges within [start, end), clipped to it; no empty range (e.g. a window clipped to [today, today))
+        low = bisect_right(self.ends, start)
+        high = bisect_left(self.starts, end)
+        ranges = [(max(self.starts[i], start), min(self.ends[i], end)) for i in range(low, high)]
+        return [(range_start, range_end) for range_start, range_end in ranges if range_start < range_end]
+
+    def free(self, start, end):
+        # the complement of `busy()` within [start, end)
+        free_ranges = []
+        for busy_start, busy_end in self.busy(start, end):
+            if start < busy_start:
+                free_ranges.append((start, busy_start))
+            start = busy_end
+        if start < end:
+            free_ranges.append((start, end))
+        return free_ranges
+
+    def __len__(self):
+        return len(self.starts)
+
+
+class AvailabilityIndex:
+    # per-worker cache of the vans' current and future bookings, rebuilt from `Transaction` on a miss;
+    # WARNING: it does not see the bookings made through the other workers until its entries expire,
+    # hence it only serves as a fast pre-check: a booking is decided by the DB (see `booking_lock()`)
+
+    def __init__(self, maxsize, ttl):
+        self.__cache = LRUCache(maxsize, ttl=ttl)
+
+    def get(self, van_id):
+        return self.get_many([van_id])[van_id]
+
+    def get_many(self, van_ids):
+        # van id -> BookedIntervals; the missing vans are loaded in a single query
+        found = {van_id: self.__cache.get(van_id) for van_id in van_ids}
+        missing = [van_id for van_id, intervals in found.items() if intervals is None]
+        if missing:
+            periods = {van_id: [] for van_id in missing}
+            today = datetime.now(SERVER_TIMEZONE).date()
+            rows = db.session.execute(
+                db.select(Transaction.van_id, Transaction.rent_commencement, Transaction.rent_expiration)
+                .where(Transaction.van_id.in_(missing), Transaction.rent_expiration > today)
+            )
+            for van_id, start, end in rows:
+                periods[van_id].append((start, end))
+            for van_id, van_periods in periods.items():
+                found[van_id] = BookedIntervals(van_periods)
+                self.__cache.set(van_id, found[van_id])
+        return found
+
+    def invalidate(self, van_id=None):
+        # the van's bookings are reloaded on the next lookup (all vans' if `van_id` is None)
+        if van_id is None:
+            self.__cache.clear()
+        else:
+            self.__cache.delete(van_id)
+
+
+availability = AvailabilityIndex(app.config["AVAILABILITY_CACHE_SIZE"], app.config["AVAILABILITY_CACHE_TTL"])
+
+# the `/vans` date searches (see `main.get_vans()`):
+# (catalog version, cursor, limit, type, min_price, max_price, available_from, available_to) -> (vans JSON, next cursor);
+# a date search is costlier than the plain catalog pages and is repeated by every customer browsing the same dates;
+# keyed by the catalog version like the catalog cache: the changes of the vans (ratings, images, hosts' names...)
+# are seen at once by every worker; the bookings are not versioned (see `forget_available_vans()`)
+available_vans_cache = LRUCache(app.config["AVAILABLE_VANS_CACHE_SIZE"], ttl=app.config["AVAILABLE_VANS_CACHE_TTL"]) \
+    if app.config["AVAILABLE_VANS_CACHE_SIZE"] else None
+
+
+def forget_available_vans():
+    # must be called when a booking changes (made, deleted in the admin panel); the other workers catch up within the TTL
+    if available_vans_cache is not None:
+        available_vans_cache.clear()
+
+# SQLite has no advisory locks; its single writer is emulated with locks striped over the van ids
+__booking_locks = [Lock() for _ in range(64)]
+
+
+@contextmanager
+def booking_lock(van_id):
+    # serializes the "check for an overlap, then insert" sequence of the bookings of a van
+    if db.session.get_bind().dialect.name == "postgresql":
+        # held until the end of the DB transaction; the `transaction_van_period_excl` exclusion constraint
+        # is the last line of defence
+        db.session.execute(db.text("SELECT pg_advisory_xact_lock(:key)"), {"key": van_id})
+        yield
+    else:
+        with __booking_locks[van_id % len(__booking_locks)]:
+            yield
+
+
+def overlaps_period(start, end):
+    # the condition on `Transaction` of a rent overlapping [start, end)
+    if db.session.get_bind().dialect.name == "postgresql":
+        # served by the GiST index of the `transaction_van_period_excl` exclusion constraint
+        # (`daterange()` is half-open by default, like the rents)
+        rent_period = db.func.daterange(Transaction.rent_commencement, Transaction.rent_expiration)
+        return rent_period.op("&&")(db.func.daterange(start, end))
+    # served by the (van_id, rent_commencement, rent_expiration) index
+    return db.and_(Transaction.rent_commencement < end, Transaction.rent_expiration > start)
+
+
+def overlapping_transactions(van_id, start, end):
+    return Transaction.query.filter(Transaction.van_id == van_id, overlaps_period(start, end))
+
+
+def van_is_booked(start, end):
+    # correlated EXISTS on `Van`: negated, it turns a catalog query into an anti-join
+    return db.exists().where(Transaction.van_id == Van.id, overlaps_period(start, end))
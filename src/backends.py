@@ -0,0 +1,43 @@
+# standard library
+from threading import Lock
+
+# other 3rd party
+try:
+    import redis  # optional; only needed by the "redis" backends
+except ImportError:
+    redis = None
+
+
+# BACKENDS: the catalog cache, the storage and the rate limiter each front a backend chosen by the config
+# (see `catalog_cache.py`, `storage.py`, `rate_limit.py`)
+
+
+class LazyBackend:
+    # the backend of the process: created (by `_create_backend()`) on first use, i.e. after gunicorn forks
+    # (a connection pool, Redis or HTTP, must not be shared by processes)
+
+    def __init__(self):
+        self.__backend = None
+        self.__lock = Lock()
+
+    @property
+    def backend(self):
+        if self.__backend is None:
+            with self.__lock:
+                if self.__backend is None:
+                    self.__backend = self._create_backend()
+        return self.__backend
+
+    def _create_backend(self):
+        raise NotImplementedError
+
+    def use(self, backend):
+        # replaces the backend (e.g. by a stand-in in the tests); None: created again from the config
+        self.__backend = backend
+
+
+def redis_client(url, name):
+    # short timeouts: an unreachable Redis must not hold the requests longer than a DB query would
+    if redis is None:
+        raise RuntimeError(f"The `redis` package is required by the redis {name} backend")
+    return redis.Redis.from_url(url, socket_timeout=0.25, socket_connect_timeout=0.25)
@@ -0,0 +1,116 @@
+import sys
+from os.path import abspath, dirname
+
+# config and models will not be accessible
+# without adding `src` to the PYTHONPATH (on the line below)
+sys.path.insert(0, abspath(dirname(dirname(__file__))))
+
+from datetime import date, timedelta
+from random import randint, seed
+from time import perf_counter
+from uuid import uuid4
+
+from sqlalchemy import create_engine, insert, text
+
+from config import db
+from models import User, Van, Transaction, Review
+
+# USAGE: python benchmarks/index_plans.py [DATABASE_URL]
+# seeds a scratch database (SQLite in memory by default) and prints the plans and timings
+# of the hot lookup queries without and with the indexes declared in `models.py`;
+# WARNING: the tables of the given database are dropped and re-created
+
+USERS = 200
+VANS = 2_000
+TRANSACTIONS = 200_000
+REVIEWS = 50_000
+REPEATS = 200
+
+QUERIES = {
+    "host transactions, newest first":
+        "SELECT * FROM \"transaction\" WHERE lessor_id = :user_id ORDER BY transaction_date DESC LIMIT 50",
+    "host transactions within dates":
+        "SELECT SUM(price) FROM \"transaction\" WHERE lessor_id = :user_id "
+        "AND transaction_date BETWEEN '2023-01-01' AND '2023-12-31'",
+    "van bookings overlapping a period":
+        "SELECT id FROM \"transaction\" WHERE van_id = :van_id "
+        "AND rent_commencement < '2024-06-10' AND rent_expiration > '2024-06-01'",
+    "host reviews, newest first":
+        "SELECT * FROM review WHERE owner_id = :user_id ORDER BY publication_date DESC LIMIT 50",
+    "van reviews, newest first":
+        "SELECT * FROM review WHERE van_id = :van_id ORDER BY publication_date DESC LIMIT 50",
+    "host vans":
+        "SELECT * FROM van WHERE host_id = :user_id",
+}
+
+
+def seed_database(connection):
+    seed(0)  # reproducible data
+    start = date(2020, 1, 1)
+    connection.execute(insert(User), [
+        {"uuid": uuid4(), "name": "Name", "surname": "Surname", "email": f"user{i}@example.com", "password": "-", "avatar": "-"}
+        for i in range(USERS)
+    ])
+    connection.execute(insert(Van), [
+        {"uuid": uuid4(), "name": f"Van{i}", "type": "Simple", "description": "-", "price_per_day": randint(50, 150),
+         "image": "-", "host_id": randint(1, USERS)}
+        for i in range(VANS)
+    ])
+    transactions = []
+    for _ in range(TRANSACTIONS):
+        commencement = start + timedelta(days=randint(0, 1800))
+        transactions.append({
+            "uuid": uuid4(), "lessee_name": "Name", "lessee_surname": "Surname", "lessee_email": "lessee@example.com",
+            "price": randint(80, 800), "transaction_date": commencement - timedelta(days=randint(1, 30)),
+            "rent_commencement": commencement, "rent_expiration": commencement + timedelta(days=randint(1, 14)),
+            "lessor_id": randint(1, USERS), "van_id": randint(1, VANS)
+        })
+    connection.execute(insert(Transaction), transactions)
+    connection.execute(insert(Review), [
+        {"uuid": uuid4(), "author": "Author", "text": "-", "rate": randint(1, 5),
+         "publication_date": start + timedelta(days=randint(0, 1800)), "owner_id": randint(1, USERS),
+         "van_id": randint(1, VANS), "van_uuid": uuid4(), "van_name": "-"}
+        for _ in range(REVIEWS)
+    ])
+
+
+def explain(connection, statement, parameters):
+    if connection.dialect.name == "sqlite":
+        rows = connection.execute(text(f"EXPLAIN QUERY PLAN {statement}"), parameters)
+        return "\n".join(f"    {row[-1]}" for row in rows)
+    rows = connection.execute(text(f"EXPLAIN {statement}"), parameters)
+    return "\n".join(f"    {row[0]}" for row in rows)
+
+
+def report(connection, title):
+    print(f"\n===== {title} =====")
+    for name, statement in QUERIES.items():
+        parameters = {"user_id": randint(1, USERS), "van_id": randint(1, VANS)}
+        started = perf_counter()
+        for _ in range(REPEATS):
+            connection.execute(text(statement), parameters).all()
+        elapsed = (perf_counter() - started) / REPEATS * 1_000
+        print(f"\n{name}: {elapsed:.3f} ms/query")
+        print(explain(connection, statement, parameters))
+
+
+def main(url):
+    engine = create_engine(url)
+    tables = [User.__table__, Van.__table__, Transaction.__table__, Review.__table__]
+    indexes = [index for table in tables for index in table.indexes]
+    with engine.begin() as connection:
+        db.metadata.drop_all(connection, tables=tables)
+        db.metadata.create_all(connection, tables=tables)
+        for index in indexes:
+            index.drop(connection)
+        seed_database(connection)
+    with engine.begin() as connection:
+        report(connection, "WITHOUT lookup indexes")
+        for index in indexes:
+            index.create(connection)
+        connection.execute(text("ANALYZE"))  # refresh the planner statistics
+        report(connection, "WITH lookup indexes")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else "sqlite://")
@@ -0,0 +1,91 @@
+import sys
+from os.path import abspath, dirname
+
+# config and models will not be accessible
+# without adding `src` to the PYTHONPATH (on the line below)
+sys.path.insert(0, abspath(dirname(dirname(__file__))))
+
+from collections import namedtuple
+from random import randint, seed
+from time import perf_counter
+from uuid import uuid4
+
+from config import app
+from json_provider import BytesJSONProvider, ORJSONProvider, orjson
+from models import User, Van
+
+# USAGE: FLASK_ENV=test python benchmarks/json_encoding.py
+# serializes `/vans` payloads of 1k and 10k vans (built in memory; no database involved):
+# ORM instances (`Van.to_JSON()`) against plain rows (`Van.row_to_JSON()`),
+# then Flask's provider (standard `json`) against orjson; prints the throughput of each path
+
+SIZES = (1_000, 10_000)
+REPEATS = 20
+
+
+def make_vans(number):
+    seed(0)  # reproducible data
+    hosts = [
+        User(uuid=uuid4(), name=f"Name{i}", surname="Surname", email=f"user{i}@example.com", password="-")
+        for i in range(max(number // 10, 1))
+    ]
+    vans = []
+    for i in range(number):
+        ratings = {f"rating_{rate}": randint(0, 20) for rate in range(1, 6)}
+        van = Van(
+            id=i + 1, uuid=uuid4(), name=f"Van{i}", type="Simple", description="A van. " * 20,
+            price_per_day=randint(50, 150), image="/static/vans/default.jpg", host=hosts[i % len(hosts)],
+            rating_sum=sum(rate * ratings[f"rating_{rate}"] for rate in range(1, 6)),
+            rating_count=sum(ratings.values()), **ratings
+        )
+        vans.append(van)
+    return vans
+
+
+def make_rows(vans):
+    # stand-ins for the rows of `Van.select_catalog()`
+    Row = namedtuple("Row", Van.select_catalog().selected_columns.keys())
+    return [
+        Row(**{column: getattr(van, column) for column in Row._fields if not column.startswith("host_")},
+            host_name=van.host.name, host_surname=van.host.surname, host_email=van.host.email)
+        for van in vans
+    ]
+
+
+def measure(function):
+    function()  # warm-up
+    started = perf_counter()
+    for _ in range(REPEATS):
+        function()
+    return (perf_counter() - started) / REPEATS
+
+
+def report(name, elapsed, number):
+    print(f"  {name:<40} {elapsed * 1_000:9.2f} ms/response {number / elapsed:12,.0f} vans/s")
+
+
+def main():
+    if orjson is None:
+        sys.exit("orjson is not installed")
+    providers = {"json (jsonify)": BytesJSONProvider(app), "orjson (jsonify)": ORJSONProvider(app)}
+    with app.app_context():
+        for number in SIZES:
+            vans = make_vans(number)
+            print(f"\n===== {number:,} vans =====")
+            rows = make_rows(vans)
+            report("Van.to_JSON() (ORM instances)", measure(lambda: [van.to_JSON() for van in vans]), number)
+            report("Van.row_to_JSON() (rows)", measure(lambda: [Van.row_to_JSON(row) for row in rows]), number)
+            payload = {"vans": [van.to_JSON() for van in vans], "nextCursor": None, "statusText": "Read successful"}
+            timings = {}
+            for name, provider in providers.items():
+                timings[name] = measure(lambda: provider.response(payload).get_data())
+                report(name, timings[name], number)
+            timings["orjson (dumps_bytes)"] = measure(lambda: providers["orjson (jsonify)"].dumps_bytes(payload))
+            report("orjson (dumps_bytes)", timings["orjson (dumps_bytes)"], number)
+            assert providers["json (jsonify)"].loads(providers["json (jsonify)"].dumps_bytes(payload)) == \
+                orjson.loads(providers["orjson (jsonify)"].dumps_bytes(payload))  # same JSON
+            print(f"  encoding speed-up: {timings['json (jsonify)'] / timings['orjson (dumps_bytes)']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import sys
+from os.path import abspath, dirname
+
+# config and the rate limiter will not be accessible
+# without adding `src` to the PYTHONPATH (on the line below)
+sys.path.insert(0, abspath(dirname(dirname(__file__))))
+
+from time import perf_counter
+
+from flask import request
+
+from config import app
+from main import limit_rate
+from rate_limit import MemoryBackend, RedisBackend, normalize_email, rate_limiter
+
+# USAGE: FLASK_ENV=test python benchmarks/rate_limiting.py
+# the overhead of the rate limiter on `/login` (see `rate_limit.py`): one bucket, the IP & email check,
+# then the whole `limit_rate()` hook (the JSON body is parsed by the route anyway, the result is cached);
+# with RATE_LIMIT_URL set, the Redis backend too (one round trip per bucket); the budget is 100 µs per request
+
+CHECKS = 100_000
+CLIENTS = 10_000  # distinct IPs & emails: the buckets do not all stay in the CPU caches
+BUDGET = 100e-6  # in seconds
+
+LIMITS = {"login": {"ip": (1_000_000, 1), "ip_email": (1_000_000, 1)}}  # never empty: every check takes a token
+
+
+def measure(check, checks=CHECKS):
+    check(0)  # warm-up
+    started = perf_counter()
+    for i in range(checks):
+        check(i)
+    return (perf_counter() - started) / checks
+
+
+def report(name, seconds):
+    verdict = "ok" if seconds < BUDGET else "OVER BUDGET"
+    print(f"  {name:<28} {seconds * 1_000_000:8.2f} µs   {verdict}")
+
+
+def request_contexts(count):
+    # built (and their JSON body parsed, as by the route) beforehand: a test request context costs more than the hook
+    contexts = []
+    for i in range(count):
+        body = {"email": f"Name{i}@example.com", "password": "12345678"}
+        context = app.test_request_context("/login", method="POST", json=body,
+                                           environ_base={"REMOTE_ADDR": f"10.0.{i // 256}.{i % 256}"})
+        with context:
+            request.get_json()
+        contexts.append(context)
+    return contexts
+
+
+def run(backend):
+    rate_limiter.use(backend)
+    report("bucket", measure(lambda i: backend.take(f"login:ip:{i % CLIENTS}", 1_000_000, 1_000_000)))
+    report("IP & email", measure(
+        lambda i: rate_limiter.check("login", f"10.0.0.{i % CLIENTS}", normalize_email(f"Name{i % CLIENTS}@example.com"))
+    ))
+    # pushing the request context is not part of the overhead: measured without the hook, then subtracted
+    contexts = request_contexts(CLIENTS)
+
+    def hook(i):
+        with contexts[i % CLIENTS]:
+            limit_rate()
+
+    def no_hook(i):
+        with contexts[i % CLIENTS]:
+            pass
+
+    report("limit_rate() hook", measure(hook) - measure(no_hook))
+
+
+def main():
+    app.config["RATE_LIMIT_ENABLED"] = True
+    app.config["RATE_LIMITS"] = LIMITS
+    print(f"\n===== memory ({CHECKS:,} checks, {CLIENTS:,} clients) =====")
+    run(MemoryBackend(app.config["RATE_LIMIT_MEMORY_SIZE"]))
+    if app.config["RATE_LIMIT_URL"]:
+        print(f"\n===== redis ({app.config['RATE_LIMIT_URL']}) =====")
+        backend = RedisBackend(app.config["RATE_LIMIT_URL"], prefix="ratelimit-benchmark:")
+        run(backend)
+        backend.clear()
+
+
+if __name__ == "__main__":
+    main()
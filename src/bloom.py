@@ -0,0 +1,31 @@
+# standard library
+from hashlib import blake2b
+from math import ceil, log
+from threading import Lock
+
+
+class BloomFilter:
+    # a probabilistic set: `item in bloom_filter` may be a false positive
+    # (with `error_rate` probability at `capacity` items), but never a false negative
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.size = ceil(-capacity * log(error_rate) / log(2) ** 2)  # number of bits
+        self.hash_count = max(1, round(self.size / capacity * log(2)))
+        self.__bits = bytearray(ceil(self.size / 8))
+        self.__lock = Lock()
+
+    def __positions(self, item):
+        # double hashing: k positions out of a single 128-bit digest
+        digest = blake2b(item.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, item):
+        positions = self.__positions(item)
+        with self.__lock:
+            for position in positions:
+                self.__bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.__bits[position >> 3] & (1 << (position & 7)) for position in self.__positions(item))
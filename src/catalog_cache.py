@@ -0,0 +1,91 @@
+# project
+from backends import LazyBackend, redis, redis_client
+from cache import LRUCache
+from config import app
+
+
+# CATALOG CACHE: the `/vans` pages and the `/vans/<uuid>` responses as ready-to-send JSON bytes;
+# the keys embed the catalog version (see `models.CatalogVersion`): a mutation bumps the version in the DB,
+# so every worker stops hitting the outdated entries at once; they are evicted by the LRU policy or expire
+
+
+class LocalBackend:
+    # per-process; the workers fill their own copies
+
+    def __init__(self, maxsize, ttl):
+        self.__entries = LRUCache(maxsize, ttl=ttl)
+
+    def get(self, key):
+        return self.__entries.get(key)
+
+    def set(self, key, value):
+        self.__entries.set(key, value)
+
+    def clear(self):
+        self.__entries.clear()
+
+
+class RedisBackend:
+    # shared by the workers (and the servers); the entries expire after `ttl` seconds
+    # NOTE: `aioredis` fails to import on Python 3.11+ and the routes are synchronous: the `redis` package is used
+
+    def __init__(self, url, ttl, prefix="catalog:"):
+        self.__client = redis_client(url, "catalog cache")
+        self.__ttl = ttl
+        self.__prefix = prefix
+
+    def get(self, key):
+        try:
+            return self.__client.get(self.__prefix + key)
+        except redis.RedisError:
+            return None  # the cache is an optimization: fall back to the DB
+
+    def set(self, key, value):
+        try:
+            self.__client.set(self.__prefix + key, value, ex=self.__ttl)
+        except redis.RedisError:
+            pass
+
+    def clear(self):
+        # the outdated versions expire by themselves; this drops the current ones as well
+        try:
+            for key in self.__client.scan_iter(match=self.__prefix + "*", count=1_000):
+                self.__client.delete(key)
+        except redis.RedisError:
+            pass
+
+
+class CatalogCache(LazyBackend):
+
+    def __init__(self, config):
+        super().__init__()
+        self.__config = config
+
+    def _create_backend(self):
+        backend = self.__config["CATALOG_CACHE_BACKEND"]
+        if backend == "local":
+            return LocalBackend(self.__config["CATALOG_CACHE_SIZE"], self.__config["CATALOG_CACHE_TTL"])
+        if backend == "redis":
+            return RedisBackend(self.__config["CATALOG_CACHE_URL"], self.__config["CATALOG_CACHE_TTL"])
+        raise ValueError(f"Unknown catalog cache backend: {backend}")
+
+    @property
+    def enabled(self):
+        return bool(self.__config["CATALOG_CACHE_BACKEND"])
+
+    def get(self, version, key):
+        # the JSON bytes cached for the catalog `version`, or None
+        if not self.enabled:
+            return None
+        return self.backend.get(f"{version}:{key}")
+
+    def set(self, version, key, value):
+        if self.enabled:
+            self.backend.set(f"{version}:{key}", value)
+
+    def clear(self):
+        if self.enabled:
+            self.backend.clear()
+
+
+catalog_cache = CatalogCache(app.config)
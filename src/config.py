@@ -7,7 +7,6 @@ from itsdangerous import URLSafeTimedSerializer
 from flask import Flask
 #
 from flask_admin import Admin
-from flask_bcrypt import Bcrypt
 from flask_cors import CORS
 from flask_executor import Executor
 from flask_jwt_extended import JWTManager
@@ -18,11 +17,18 @@ from flask_sqlalchemy import SQLAlchemy
 # 3rd party misc
 from dotenv import load_dotenv
 from pytz import timezone
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+# project
+from hashing import HashingPool
+from json_provider import get_json_provider_class
+from uploads import UploadRequest
 
 load_dotenv()
 
 
 app = Flask(__name__)  # instantiate flask app
+app.request_class = UploadRequest  # per-route body size caps (see `uploads.py`)
 
 
 class Config:
@@ -39,12 +45,103 @@ class Config:
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=1)
     JWT_REFRESH_TOKEN_EXPIRES = timedelta(days=14)
     #
+    # password hashing runs in a pool of processes (see `hashing.py`)
+    BCRYPT_LOG_ROUNDS = 12
+    BCRYPT_LATENCY_BUDGET_MS = None  # if set, overrides BCRYPT_LOG_ROUNDS with a cost calibrated on startup
+    BCRYPT_MIN_LOG_ROUNDS = 10  # the calibrated cost never goes below it
+    BCRYPT_POOL_SIZE = 2  # processes per server worker
+    BCRYPT_QUEUE_LIMIT = 16  # waiting hashing jobs per server worker; more yield 429
+    #
     MAIL_SERVER = getenv("MAIL_SERVER")
     MAIL_PORT = getenv("MAIL_PORT")
     MAIL_USERNAME = getenv("MAIL_USERNAME")
     MAIL_PASSWORD = getenv("MAIL_PASSWORD")
     MAIL_USE_TLS = True
     MAIL_USE_SSL = False
+    MAIL_TIMEOUT = 10  # in seconds
+    # "mailman": a connection per batch of emails; "aiosmtplib": a pool of connections kept open (see `mail_worker.py`)
+    MAIL_TRANSPORT = "mailman"
+    MAIL_POOL_SIZE = 4  # SMTP connections per server worker
+    MAIL_POOL_IDLE_TIMEOUT = 60  # in seconds; most servers drop the idle sessions after a few minutes
+    #
+    VANS_PAGE_SIZE = 50  # default number of vans per `/vans` page
+    VANS_MAX_PAGE_SIZE = 200  # `limit` query parameter ceiling
+    RECORDS_PAGE_SIZE = 50  # default number of transactions/reviews per `/getTransactions` & `/getReviews` page
+    RECORDS_MAX_PAGE_SIZE = 200
+    #
+    # outgoing emails are queued in the DB and sent by a dispatcher thread per worker (see `outbox.py`)
+    OUTBOX_DISPATCHER = True  # False: nothing is sent but by `outbox.dispatch()` (the tests)
+    OUTBOX_POLL_INTERVAL = 5  # in seconds; the dispatcher is also woken up by every new email
+    OUTBOX_BATCH_SIZE = 50  # emails per SMTP connection
+    OUTBOX_LEASE = 300  # in seconds; a claimed email left unsent that long (e.g. a killed worker) is claimed again
+    OUTBOX_MAX_ATTEMPTS = 6  # then dead-lettered
+    OUTBOX_RETRY_DELAY = 30  # in seconds, before the second attempt; doubled after every failure
+    OUTBOX_MAX_RETRY_DELAY = 3_600
+    #
+    # in-process Bloom filter of registered emails; lets most "is the email free" checks skip the DB
+    EMAIL_BLOOM_FILTER = False
+    EMAIL_BLOOM_CAPACITY = 1_000_000  # ~1.2 MB per worker at the error rate below
+    EMAIL_BLOOM_ERROR_RATE = 0.01
+    #
+    # per-worker cache of the users resolved from access tokens, keyed by the token's `jti`; 0 disables it
+    # (the email-identity tokens only: the id-identity ones carry the fields of the user, see `__create_access_token()`)
+    IDENTITY_CACHE_SIZE = 10_000
+    IDENTITY_CACHE_TTL = 60  # in seconds; bounds the staleness seen by the other workers after an update
+    #
+    # per-worker cache of the vans' booked periods (see `availability.py`)
+    AVAILABILITY_CACHE_SIZE = 10_000  # vans
+    AVAILABILITY_CACHE_TTL = 60  # in seconds
+    AVAILABILITY_WINDOW_DAYS = 90  # default `/vans/<uuid>/availability` window
+    AVAILABILITY_MAX_WINDOW_DAYS = 366
+    # per-worker cache of the `/vans?available_from=&available_to=` pages; 0 disables it
+    AVAILABLE_VANS_CACHE_SIZE = 1_000  # pages
+    AVAILABLE_VANS_CACHE_TTL = 10  # in seconds; bounds the staleness after the bookings made through the other workers
+    #
+    # cache of the serialized `/vans` pages & `/vans/<uuid>` responses (see `catalog_cache.py`):
+    # `local` (per worker), `redis` (shared) or None (disabled)
+    CATALOG_CACHE_BACKEND = None
+    CATALOG_CACHE_URL = getenv("REDIS_URL")  # e.g. redis://localhost:6379/0
+    CATALOG_CACHE_SIZE = 2_000  # responses; `local` only
+    CATALOG_CACHE_TTL = 300  # in seconds; the outdated versions are never read, this only frees the memory
+    #
+    # `jsonify()` & co. (see `json_provider.py`): "orjson" (the standard `json` if not installed) or "json"
+    JSON_PROVIDER = "orjson"
+    #
+    # uploaded pictures are turned into resized renditions in the background (see `images.py`)
+    IMAGE_MAX_PIXELS = 40_000_000  # larger uploads are refused before being decoded
+    IMAGE_QUALITY = 80  # WebP & JPEG
+    #
+    # where the renditions are stored (see `storage.py`): "local" (STATIC_FOLDER) or "s3" (an S3-compatible bucket)
+    STORAGE_BACKEND = "local"
+    S3_ENDPOINT_URL = getenv("S3_ENDPOINT_URL")  # e.g. https://s3.eu-central-1.amazonaws.com, http://localhost:9000
+    S3_BUCKET = getenv("S3_BUCKET")
+    S3_REGION = getenv("S3_REGION", "us-east-1")
+    S3_ACCESS_KEY_ID = getenv("S3_ACCESS_KEY_ID")
+    S3_SECRET_ACCESS_KEY = getenv("S3_SECRET_ACCESS_KEY")
+    S3_PATH_STYLE = getenv("S3_PATH_STYLE", "true").lower() == "true"  # `<endpoint>/<bucket>` (MinIO); AWS: false
+    S3_PUBLIC_URL = getenv("S3_PUBLIC_URL")  # a public bucket or a CDN in front of it; presigned URLs without it
+    S3_URL_EXPIRES = 86_400  # presigned URLs, in seconds; at most 7 days
+    S3_PART_SIZE = 8 * 1024 * 1024  # larger objects are sent in a multipart upload; at least 5 MiB (S3)
+    #
+    # token buckets of the login, registration & password reset routes (see `rate_limit.py`), by endpoint:
+    # {"ip"/"email"/"ip_email": (burst, period in seconds)}; `memory` (per worker) or `redis` (shared) backend;
+    # `/login` is not limited per email alone: anyone could lock a user out
+    RATE_LIMIT_ENABLED = True
+    RATE_LIMIT_BACKEND = "memory"
+    RATE_LIMIT_URL = getenv("REDIS_URL")  # e.g. redis://localhost:6379/0
+    RATE_LIMIT_MEMORY_SIZE = 100_000  # buckets; `memory` only
+    RATE_LIMITS = {
+        "login": {"ip": (20, 60), "ip_email": (5, 60)},
+        "register": {"ip": (5, 300), "email": (3, 3_600)},
+        "send_reset_email": {"ip": (5, 300), "email": (3, 900)},
+    }
+    # the proxies in front of the app (setting `X-Forwarded-For`): the rate limits key on the client's IP, not theirs
+    PROXY_FIX_X_FOR = int(getenv("PROXY_FIX_X_FOR", 0))
+    #
+    # request body caps, in bytes (see `uploads.py`); the picture routes are listed by endpoint
+    MAX_CONTENT_LENGTH = 1024 * 1024
+    UPLOAD_SIZE_LIMITS = {"upload_van_image": 10 * 1024 * 1024, "upload_avatar": 5 * 1024 * 1024}
+    UPLOAD_SNIFF_BYTES = 256 * 1024  # an upload whose image header is not complete within it is discarded
 
 
 class ProdConfig(Config):
@@ -57,6 +154,18 @@ class ProdConfig(Config):
     #
     RESET_PW_TOKEN_EXP = 900  # THIS IS FOR PW RESET FORM: IN SECONDS = 15 min.
     #
+    EMAIL_BLOOM_FILTER = True
+    #
+    CATALOG_CACHE_BACKEND = getenv("CATALOG_CACHE_BACKEND", "local")
+    #
+    STORAGE_BACKEND = getenv("STORAGE_BACKEND", "local")
+    #
+    MAIL_TRANSPORT = getenv("MAIL_TRANSPORT", "aiosmtplib")
+    #
+    RATE_LIMIT_BACKEND = getenv("RATE_LIMIT_BACKEND", "memory")
+    #
+    BCRYPT_LATENCY_BUDGET_MS = 200  # hashes below the calibrated cost are upgraded on login
+    #
     JWT_COOKIE_SECURE = True
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=1)
     JWT_REFRESH_TOKEN_EXPIRES = timedelta(days=14)
@@ -74,6 +183,12 @@ class TestConfig(Config):
     #
     RESET_PW_TOKEN_EXP = 5  # THIS IS FOR PW RESET FORM: IN SECONDS
     #
+    BCRYPT_LOG_ROUNDS = 4  # the lowest cost bcrypt allows; keeps the tests fast
+    #
+    RATE_LIMIT_ENABLED = False  # the tests call the routes repeatedly; enabled by the rate limiting tests only
+    #
+    OUTBOX_DISPATCHER = False  # the tests dispatch the emails themselves; sent to `mail.outbox` (locmem backend)
+    #
     JWT_COOKIE_SECURE = False
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(seconds=5)
     JWT_REFRESH_TOKEN_EXPIRES = timedelta(minutes=1)
@@ -92,12 +207,17 @@ if getenv("FLASK_ENV") != "test":
 else:
     app.config.from_object(TestConfig)
 
+if app.config["PROXY_FIX_X_FOR"]:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["PROXY_FIX_X_FOR"])
+
+app.json = get_json_provider_class(app.config["JSON_PROVIDER"])(app)
+
 
 admin = Admin(app, name="Vans", template_mode='bootstrap4')
-bcrypt = Bcrypt(app)
+bcrypt = HashingPool(app)
 db = SQLAlchemy(app)
 executor = Executor(app)
 jwt = JWTManager(app)
 mail = Mail(app)
-migrate = Migrate(app, db)
+migrate = Migrate(app, db, directory=path.join(path.dirname(__file__), "migrations"))
 serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'])
@@ -0,0 +1,116 @@
+# standard library
+import hmac
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from hashlib import sha256
+from multiprocessing import get_context
+from math import floor, log2
+from os import cpu_count
+from threading import BoundedSemaphore, Lock
+from time import perf_counter
+
+# 3rd party
+import bcrypt
+from flask_bcrypt import Bcrypt
+
+
+class HashingPoolSaturated(Exception):
+    # every process of the pool is busy and the queue is full; the view functions answer 429
+    pass
+
+
+def _hashpw(password, salt):
+    # runs inside a pool process; must be a module-level function to be picklable
+    return bcrypt.hashpw(password, salt)
+
+
+class HashingPool(Bcrypt):
+    # the API of `flask_bcrypt.Bcrypt`, but the bcrypt work runs in a bounded pool of processes:
+    # a burst of logins is queued there instead of pinning the CPU of the threads serving other routes
+    #
+    # config:
+    #   BCRYPT_LOG_ROUNDS - the cost factor (`flask_bcrypt`'s setting)
+    #   BCRYPT_LATENCY_BUDGET_MS - if set, the cost factor is calibrated on startup instead:
+    #       the highest one whose hashing fits the budget on the current hardware (see `calibrate()`)
+    #   BCRYPT_MIN_LOG_ROUNDS - the calibration never goes below it
+    #   BCRYPT_POOL_SIZE - hashing processes per server worker
+    #   BCRYPT_QUEUE_LIMIT - hashing jobs allowed to wait for a process; beyond it `HashingPoolSaturated` is raised
+
+    def init_app(self, app):
+        super().init_app(app)
+        self._pool_size = app.config.get("BCRYPT_POOL_SIZE", cpu_count() or 1)
+        self._queue_limit = app.config.get("BCRYPT_QUEUE_LIMIT", 4 * self._pool_size)
+        self._slots = BoundedSemaphore(self._pool_size + self._queue_limit)
+        self._pool = None
+        self._pool_lock = Lock()
+        budget = app.config.get("BCRYPT_LATENCY_BUDGET_MS")
+        if budget:
+            self._log_rounds = self.calibrate(budget, app.config.get("BCRYPT_MIN_LOG_ROUNDS", 10))
+
+    @property
+    def log_rounds(self):
+        return self._log_rounds
+
+    @staticmethod
+    def calibrate(budget_ms, min_rounds=4, probe_rounds=8):
+        # every extra round doubles the bcrypt work: time a cheap probe and extrapolate
+        salt = bcrypt.gensalt(rounds=probe_rounds)
+        elapsed = min(HashingPool.__time_hashpw(salt) for _ in range(3))  # the least disturbed sample
+        rounds = probe_rounds + floor(log2(budget_ms / 1000 / elapsed))
+        return min(max(rounds, min_rounds, 4), 31)  # bcrypt's own bounds: 4 to 31
+
+    @staticmethod
+    def __time_hashpw(salt):
+        started = perf_counter()
+        bcrypt.hashpw(b"calibration", salt)
+        return perf_counter() - started
+
+    def needs_rehash(self, pw_hash):
+        # bcrypt hashes look like `$2b$12$<salt & checksum>`; the cost is the second field
+        try:
+            return int(self._unicode_to_bytes(pw_hash).split(b"$")[2]) < self._log_rounds
+        except (IndexError, ValueError):
+            return False  # not a bcrypt hash
+
+    def _get_pool(self):
+        # created lazily, i.e. after gunicorn has forked its workers;
+        # "spawn" does not copy the threads and locks of a running server into the pool processes
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self._pool_size, mp_context=get_context("spawn"))
+            return self._pool
+
+    def _hashpw(self, password, salt):
+        if not self._slots.acquire(blocking=False):
+            raise HashingPoolSaturated()
+        try:
+            future = self._get_pool().submit(_hashpw, password, salt)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            # a pool process has died; start a new pool for the next calls
+            with self._pool_lock:
+                self._pool = None
+            raise
+
+    def _prepare_password(self, password):
+        password = self._unicode_to_bytes(password)
+        if self._handle_long_passwords:
+            password = self._unicode_to_bytes(sha256(password).hexdigest())
+        return password
+
+    def generate_password_hash(self, password, rounds=None, prefix=None):
+        if not password:
+            raise ValueError('Password must be non-empty.')
+        rounds = self._log_rounds if rounds is None else rounds
+        prefix = self._prefix if prefix is None else prefix
+        salt = bcrypt.gensalt(rounds=rounds, prefix=self._unicode_to_bytes(prefix))
+        return self._hashpw(self._prepare_password(password), salt)
+
+    def check_password_hash(self, pw_hash, password):
+        pw_hash = self._unicode_to_bytes(pw_hash)
+        return hmac.compare_digest(self._hashpw(self._prepare_password(password), pw_hash), pw_hash)
@@ -0,0 +1,129 @@
+# standard library
+import os
+import re
+from hashlib import sha256
+from io import BytesIO
+
+# 3rd party
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+
+# IMAGE PIPELINE: an uploaded picture is decoded once and written as resized renditions in WebP and JPEG;
+# the listings download a thumbnail or a card of a few kilobytes instead of the original photo
+#
+# the renditions of an upload share a key: `<key>_<rendition>.<extension>`;
+# the `image`/`avatar` columns store the path of the full JPEG, from which the other paths are derived
+#
+# IMAGE STORE: the key is the SHA-256 of the normalized picture (upright, metadata-free pixels of the full rendition);
+# the renditions are stored as `images/<key[:2]>/<key>_<rendition>.<extension>` (see `storage.py`), once whatever
+# the number of vans/users showing them (reference counted, see `models.ImageBlob`); they are cached as immutable
+# NOTE: the renditions written before the store have a random 32-hex key in the owner's folder
+
+RENDITIONS = {"thumb": 160, "card": 480, "full": 1600}  # the longest side, in pixels; from the smallest
+FORMATS = {"webp": "WEBP", "jpeg": "JPEG"}  # extension: PIL format
+CONTENT_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg"}
+STORE_FOLDER = "images"
+UPLOAD_FORMATS = {"JPEG", "PNG"}
+UPLOAD_MAGIC_BYTES = (b"\xff\xd8\xff", b"\x89PNG\r\n\x1a\n")  # JPEG, PNG
+
+__rendition_name = re.compile(r"(?P<key>[0-9a-f]{64}|[0-9a-f]{32})_full\.jpeg")
+__blob_name = re.compile(r"(?P<key>[0-9a-f]{64})_(thumb|card|full)\.(webp|jpeg)")
+
+
+class InvalidImage(Exception):
+    pass
+
+
+def sniff_image(prefix, max_pixels):
+    # checks the first bytes of an upload without decoding it: the magic bytes, then the header (PIL reads it lazily);
+    # returns None while the prefix is too short to tell; raises InvalidImage
+    if not any(prefix[:len(magic)] == magic[:len(prefix)] for magic in UPLOAD_MAGIC_BYTES):
+        raise InvalidImage("The file is not an image")
+    try:
+        with Image.open(BytesIO(prefix)) as image:
+            image_format, (width, height) = image.format, image.size
+    except Image.DecompressionBombError:
+        raise InvalidImage("The image is too large")
+    except Exception:
+        return None  # a truncated header
+    if image_format not in UPLOAD_FORMATS:
+        raise InvalidImage("The file is not an image")
+    if width * height > max_pixels:
+        raise InvalidImage("The image is too large")
+    return image_format, (width, height)
+
+
+def rendition_paths(image_path):
+    # rendition -> extension -> path; an image stored as a single file (e.g. the default one) stands for all
+    folder, file_name = os.path.split(image_path)
+    match = __rendition_name.fullmatch(file_name)
+    if not match:
+        return {name: {extension: image_path for extension in FORMATS} for name in RENDITIONS}
+    return {
+        name: {extension: os.path.join(folder, f"{match['key']}_{name}.{extension}") for extension in FORMATS}
+        for name in RENDITIONS
+    }
+
+
+def store_path(key):
+    # the `image`/`avatar` column of a picture of the store: its full JPEG
+    return f"{STORE_FOLDER}/{key[:2]}/{key}_full.jpeg"
+
+
+def blob_key(path):
+    # the key of a file of the image store (any rendition), or None
+    match = __blob_name.fullmatch(os.path.basename(path))
+    return match["key"] if match else None
+
+
+def __normalize(source_path):
+    # upright, metadata-free RGB(A) pixels no larger than the full rendition; (image, has_alpha)
+    with Image.open(source_path) as source:
+        # JPEG only: decode at the smallest scale (1/2, 1/4 or 1/8) still larger than the full rendition
+        source.draft("RGB", (RENDITIONS["full"], RENDITIONS["full"]))
+        image = ImageOps.exif_transpose(source)  # turns phone photos upright; a decoded copy
+    has_alpha = image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info)
+    image = image.convert("RGBA" if has_alpha else "RGB")
+    image.info = {}  # EXIF (GPS position, camera...), ICC profile and comments are not written out
+    image.thumbnail((RENDITIONS["full"], RENDITIONS["full"]), Image.Resampling.LANCZOS)  # keeps the aspect ratio; never enlarges
+    return image, has_alpha
+
+
+def __save(image, path, image_format, quality, has_alpha):
+    if image_format == "JPEG" and has_alpha:
+        # JPEG has no transparency: flatten onto white
+        flattened = Image.new("RGB", image.size, "white")
+        flattened.paste(image, mask=image.getchannel("A"))
+        flattened.save(path, image_format, quality=quality, optimize=True, progressive=True)
+    elif image_format == "JPEG":
+        image.save(path, image_format, quality=quality, optimize=True, progressive=True)
+    else:
+        image.save(path, image_format, quality=quality, method=4)
+
+
+def make_renditions(source_path, folder, quality=80, is_stored=None):
+    # decodes the source once and writes every rendition into `folder` as `<key>_<rendition>.<extension>`;
+    # returns the store path of the picture (see `store_path()`); nothing is written if `is_stored(store path)`;
+    # raises InvalidImage
+    try:
+        image, has_alpha = __normalize(source_path)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError, ValueError):
+        raise InvalidImage("The file is not an image")
+    digest = sha256(f"{image.mode}:{image.width}x{image.height}:".encode())
+    digest.update(image.tobytes())
+    key = digest.hexdigest()
+    if is_stored is not None and is_stored(store_path(key)):
+        return store_path(key)
+    os.makedirs(folder, exist_ok=True)
+    # from the largest rendition down: each one is resized from the previous
+    for name, side in sorted(RENDITIONS.items(), key=lambda rendition: -rendition[1]):
+        image.thumbnail((side, side), Image.Resampling.LANCZOS)
+        for extension, image_format in FORMATS.items():
+            __save(image, os.path.join(folder, f"{key}_{name}.{extension}"), image_format, quality, has_alpha)
+    return store_path(key)
+
+
+def remove_renditions(image_path):
+    for path in {path for paths in rendition_paths(image_path).values() for path in paths.values()}:
+        if os.path.exists(path):
+            os.remove(path)
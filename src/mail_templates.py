@@ -0,0 +1,51 @@
+# standard library
+import re
+
+# 3rd party misc
+from markupsafe import escape
+
+# project
+from config import app
+
+
+# MAIL TEMPLATES: the emails only substitute a few values (`{{name}}`, `{{reset_url}}`...) into static HTML;
+# each template is compiled once, on startup: whitespace collapsed, then split around its placeholders;
+# rendering joins the static parts with the escaped values, without Jinja, the app context or the request
+# NOTE: the templates carry their CSS inline (`style` attributes, for the email clients): nothing left to inline
+
+MAIL_TEMPLATES = ("mail/registration.html", "mail/change_email.html")
+
+
+class MailTemplate:
+    placeholder = re.compile(r"{{\s*(\w+)\s*}}")
+
+    def __init__(self, source):
+        if "{%" in source or "{#" in source or source.count("{{") != len(self.placeholder.findall(source)):
+            # statements, comments, filters...: beyond plain substitution
+            raise ValueError("A mail template may only contain `{{ name }}` placeholders")
+        source = re.sub(r">\s+<", "><", source.strip())  # the indentation between the tags
+        source = re.sub(r"\s+", " ", source)  # HTML collapses the whitespace of the text anyway
+        parts = self.placeholder.split(source)
+        self.statics = parts[0::2]  # one more than the placeholders
+        self.names = parts[1::2]
+
+    def render(self, **values):
+        escaped = {name: escape(value) for name, value in values.items()}  # like Jinja's autoescape
+        parts = [self.statics[0]]
+        for name, static in zip(self.names, self.statics[1:]):
+            parts.append(escaped[name])
+            parts.append(static)
+        return "".join(parts)
+
+
+def __compile(name):
+    source, _, _ = app.jinja_loader.get_source(app.jinja_env, name)
+    return MailTemplate(source)
+
+
+__templates = {name: __compile(name) for name in MAIL_TEMPLATES}
+
+
+def render_mail(template_name, **values):
+    # `render_template()` for the templates of MAIL_TEMPLATES; a missing value raises KeyError
+    return __templates[template_name].render(**values)
@@ -0,0 +1,191 @@
+# standard library
+import asyncio
+import socket
+from collections import deque
+from threading import Lock, Thread
+from time import monotonic, perf_counter
+
+# other 3rd party
+try:
+    import aiosmtplib  # optional; only needed by the "aiosmtplib" mail transport
+except ImportError:
+    aiosmtplib = None
+
+# project
+from config import app
+
+
+# MAIL WORKER: an asyncio event loop in a thread of its own keeps a small pool of open, authenticated SMTP connections;
+# the outbox (see `outbox.py`) hands it whole batches: the messages are sent concurrently over the pool,
+# so a spike of signups costs a few TLS handshakes instead of one per message
+#
+# a connection idle for longer than MAIL_POOL_IDLE_TIMEOUT is closed (the servers drop them anyway);
+# one dropped by the server in the meantime is replaced once, transparently
+
+
+class SMTPPool:
+    # lives in the worker's loop; `acquire()` waits while MAIL_POOL_SIZE connections are busy
+
+    def __init__(self, size, idle_timeout, connect):
+        self.__slots = asyncio.Semaphore(size)
+        self.__idle = []  # (connection, released at)
+        self.__idle_timeout = idle_timeout
+        self.__connect = connect
+        self.opened = 0
+
+    @property
+    def idle(self):
+        return len(self.__idle)
+
+    async def acquire(self):
+        # (connection, reused)
+        await self.__slots.acquire()
+        try:
+            while self.__idle:
+                connection, released = self.__idle.pop()
+                if connection.is_connected and monotonic() - released < self.__idle_timeout:
+                    return connection, True
+                await self.__close(connection)
+            connection = await self.__connect()
+            self.opened += 1
+            return connection, False
+        except BaseException:
+            self.__slots.release()
+            raise
+
+    async def release(self, connection, reusable=True):
+        if reusable and connection.is_connected:
+            self.__idle.append((connection, monotonic()))
+        else:
+            await self.__close(connection)
+        self.__slots.release()
+
+    async def close(self):
+        while self.__idle:
+            await self.__close(self.__idle.pop()[0])
+
+    @staticmethod
+    async def __close(connection):
+        try:
+            await connection.quit()
+        except Exception:
+            connection.close()  # dropped already
+
+
+class MailWorker:
+
+    def __init__(self, config):
+        self.__config = config
+        self.__loop = None
+        self.__pool = None
+        self.__lock = Lock()
+        # counters; the latencies of the last messages make the averages
+        self.__started = monotonic()
+        self.__sent = 0
+        self.__failed = 0
+        self.__in_flight = 0
+        self.__latencies = deque(maxlen=1_000)  # seconds
+        self.__completed = deque(maxlen=10_000)  # monotonic times of the last messages sent
+
+    def __start(self):
+        # the loop thread; started on first use, i.e. after gunicorn forks (threads do not survive a fork)
+        if self.__loop is not None:
+            return self.__loop
+        with self.__lock:
+            if self.__loop is None:
+                if aiosmtplib is None:
+                    raise RuntimeError("The `aiosmtplib` package is required by the aiosmtplib mail transport")
+                loop = asyncio.new_event_loop()
+                Thread(target=loop.run_forever, name="mail-worker", daemon=True).start()
+                local_hostname = socket.getfqdn()  # would block the loop on every EHLO otherwise
+                self.__pool = SMTPPool(self.__config["MAIL_POOL_SIZE"], self.__config["MAIL_POOL_IDLE_TIMEOUT"],
+                                       lambda: self.__connect(local_hostname))
+                self.__loop = loop
+        return self.__loop
+
+    def send_many(self, messages):
+        # Flask-Mailman messages -> the exception of each one, None if sent; blocks until the batch is done
+        envelopes = []
+        for message in messages:
+            try:
+                # built in the calling thread: Flask-Mailman needs the app context; the headers are validated here
+                envelopes.append((message.message(), message.from_email, message.recipients()))
+            except Exception as error:
+                envelopes.append(error)
+        future = asyncio.run_coroutine_threadsafe(self.__send_many(envelopes), self.__start())
+        return future.result()
+
+    def stop(self):
+        # closes the idle connections and the loop
+        if self.__loop is None:
+            return None
+        asyncio.run_coroutine_threadsafe(self.__pool.close(), self.__loop).result()
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+        self.__loop = None
+
+    def stats(self):
+        now = monotonic()
+        latencies = list(self.__latencies)
+        return {
+                "sent": self.__sent,
+                "failed": self.__failed,
+                "inFlight": self.__in_flight,
+                "sentLastMinute": sum(1 for completed in self.__completed if now - completed < 60),
+                "latencyAvgMs": round(1_000 * sum(latencies) / len(latencies), 2) if latencies else None,
+                "latencyMaxMs": round(1_000 * max(latencies), 2) if latencies else None,
+                "connectionsOpened": self.__pool.opened if self.__pool else 0,
+                "connectionsIdle": self.__pool.idle if self.__pool else 0,
+                "uptime": round(now - self.__started),
+                }
+
+    async def __connect(self, local_hostname):
+        config = self.__config
+        connection = aiosmtplib.SMTP(
+            hostname=config["MAIL_SERVER"], port=int(config["MAIL_PORT"]) if config["MAIL_PORT"] else None,
+            username=config["MAIL_USERNAME"], password=config["MAIL_PASSWORD"],
+            use_tls=config["MAIL_USE_SSL"], start_tls=config["MAIL_USE_TLS"],
+            local_hostname=local_hostname, timeout=config["MAIL_TIMEOUT"]
+        )
+        await connection.connect()  # EHLO, STARTTLS, AUTH
+        return connection
+
+    async def __send_many(self, envelopes):
+        return await asyncio.gather(*(self.__send(envelope) for envelope in envelopes))
+
+    async def __send(self, envelope):
+        if isinstance(envelope, Exception):
+            self.__failed += 1
+            return envelope
+        self.__in_flight += 1
+        started = perf_counter()
+        try:
+            await self.__send_mime(*envelope)
+        except Exception as error:
+            self.__failed += 1
+            return error
+        finally:
+            self.__in_flight -= 1
+        self.__sent += 1
+        self.__latencies.append(perf_counter() - started)
+        self.__completed.append(monotonic())
+        return None
+
+    async def __send_mime(self, mime, sender, recipients):
+        connection, reused = await self.__pool.acquire()
+        try:
+            await connection.send_message(mime, sender=sender, recipients=recipients)
+        except aiosmtplib.SMTPServerDisconnected:
+            await self.__pool.release(connection, reusable=False)
+            if not reused:
+                raise
+            return await self.__send_mime(mime, sender, recipients)  # dropped while idle: sent again
+        except (aiosmtplib.SMTPRecipientsRefused, aiosmtplib.SMTPSenderRefused, aiosmtplib.SMTPDataError):
+            await self.__pool.release(connection)  # the message is refused, the session goes on
+            raise
+        except BaseException:
+            await self.__pool.release(connection, reusable=False)  # e.g. a timeout: the session state is unknown
+            raise
+        await self.__pool.release(connection)
+
+
+mail_worker = MailWorker(app.config)
@@ -1,21 +1,42 @@
 # system
+import json
 import os
 import shutil
-from datetime import datetime, timedelta
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import namedtuple
+from contextlib import suppress
+from datetime import date, datetime, timedelta
+from math import ceil
+from threading import Lock
 from uuid import uuid4, UUID
 
 # 3rd party flask
-from flask import current_app, flash, jsonify, redirect, render_template, request, session
-from flask_mailman import EmailMessage
-from flask_jwt_extended import create_access_token, create_refresh_token, get_jwt_identity, jwt_required
+import click
+from flask import current_app, flash, g, jsonify, redirect, render_template, request, session
+from flask_jwt_extended import create_access_token, create_refresh_token, get_jwt, get_jwt_identity, jwt_required
+from sqlalchemy.exc import IntegrityError
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import is_resource_modified
 
 # 3rd party misc
-from PIL import Image
 from pytz import utc
 
 # project
+from availability import (availability, available_vans_cache, booking_lock, forget_available_vans,
+                          overlapping_transactions, van_is_booked)
+from bloom import BloomFilter
+from cache import LRUCache
+from catalog_cache import catalog_cache
 from config import app, bcrypt, db, executor, serializer, SERVER_TIMEZONE
-from models import User, Van, Transaction, Review
+from hashing import HashingPoolSaturated
+from images import CONTENT_TYPES, blob_key, make_renditions, rendition_paths
+from mail_templates import render_mail
+from mail_worker import mail_worker
+from models import User, Van, Transaction, Review, acquire_image, apply_review_rating, bump_catalog_version, \
+    get_catalog_version, rebuild_rating_summaries, release_image
+from outbox import enqueue_email, outbox, requeue_dead_emails
+from rate_limit import normalize_email, rate_limiter
+from storage import remove_image, storage
 
 
 @app.route("/")
@@ -60,30 +81,104 @@ def send_static(static):
 # cache static files
 @app.after_request
 def add_header(response):
-    if request.path.startswith('/static'):
+    if request.path.startswith('/static') and blob_key(request.path):
+        # a file of the image store never changes: its name is the hash of its content (see `images.py`)
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    elif request.path.startswith('/static'):
         response.headers['Cache-Control'] = 'public, max-age=604800'  # store static on FrontEnd for 1 week
     return response
 #
 
 
-def __send_email_on_signup(email, name, surname):
-    message = EmailMessage(
+# the request body exceeds MAX_CONTENT_LENGTH or the route's UPLOAD_SIZE_LIMITS (see `uploads.py`)
+@app.errorhandler(RequestEntityTooLarge)
+def request_entity_too_large(error):
+    if request.endpoint in app.config["UPLOAD_SIZE_LIMITS"]:
+        return jsonify(message="The file is too large", statusText="Invalid file", imgMsg=True), 413
+    return jsonify(message="The request is too large", statusText="Request too large"), 413
+
+
+# the password hashing pool is busy (see `hashing.py`)
+@app.errorhandler(HashingPoolSaturated)
+def hashing_pool_saturated(error):
+    response = jsonify(message="Server is busy, try again later", statusText="Too many requests")
+    response.headers["Retry-After"] = "1"
+    return response, 429
+
+
+# the login, registration & password reset routes are throttled per client IP and per email (see `rate_limit.py`)
+@app.before_request
+def limit_rate():
+    if not rate_limiter.limits(request.endpoint):
+        return None
+    data = request.get_json(silent=True)
+    email = data.get("email") if isinstance(data, dict) else None
+    email = normalize_email(email) if isinstance(email, str) else None
+    retry_after = rate_limiter.check(request.endpoint, request.remote_addr, email)
+    if retry_after is None:
+        return None
+    response = jsonify(message="Too many attempts, try again later", statusText="Too many requests")
+    response.headers["Retry-After"] = str(ceil(retry_after))
+    return response, 429
+
+
+# the emails are queued with the changes calling for them and sent in the background (see `outbox.py`)
+@app.before_request
+def start_outbox():
+    outbox.start()  # the emails queued before a restart are sent without waiting for a new one
+
+
+def __queue_email_on_signup(email, name, surname):
+    enqueue_email(
         subject="VanLife: Successful Registration",
-        body=render_template("mail/registration.html", name=name, surname=surname),
-        from_email="vanlife@support.com",
-        to=[email]
+        body=render_mail("mail/registration.html", name=name, surname=surname),
+        to=email
         )
-    message.content_subtype = "html"  # this must be set to send html, not plain text
-    try:
-        message.send()
-    except Exception as e:
-        return None  # don't break the registration process; just don't send an email
 
 # for pw reseting
 def __generate_reset_token(email):
     return serializer.dumps(email, salt=app.config['SALT'])
 
 
+def __email_is_registered(email):
+    # `user.email` is UNIQUE (i.e. indexed): an index lookup instead of loading the users
+    return db.session.query(User.query.filter_by(email=email).exists()).scalar()
+
+
+__email_filter = None  # see `__get_email_filter()`
+__email_filter_lock = Lock()
+
+
+def __get_email_filter():
+    # the Bloom filter is warmed with the registered emails on first use (i.e. after gunicorn forks);
+    # WARNING: it only knows the emails registered through THIS process after warming up;
+    # the UNIQUE constraint on `user.email` stays the ultimate guard (see `register()`)
+    global __email_filter
+    if not app.config["EMAIL_BLOOM_FILTER"]:
+        return None
+    with __email_filter_lock:
+        if __email_filter is None:
+            email_filter = BloomFilter(app.config["EMAIL_BLOOM_CAPACITY"], app.config["EMAIL_BLOOM_ERROR_RATE"])
+            for email in db.session.execute(db.select(User.email).execution_options(yield_per=10_000)).scalars():
+                email_filter.add(email)
+            __email_filter = email_filter
+    return __email_filter
+
+
+def __email_is_taken(email):
+    email_filter = __get_email_filter()
+    if email_filter is not None and email not in email_filter:
+        return False  # a Bloom filter has no false negatives; skip the DB
+    return __email_is_registered(email)
+
+
+__email_taken_message = {
+    "message": "This email is taken",
+    "statusText": "Email is not unique",
+    "emailErr": True  # highlights the input in red (Frontend)
+}
+
+
 def __validate_email(email):
     # WARNING: do NOT jsonify the dicts;
     # it is done in the view functions
@@ -96,14 +191,9 @@ def __validate_email(email):
                 "statusText": "Invalid email format",
                 "emailErr": True  # highlights the input in red (Frontend)
                }
-    registred_emails = list(map(lambda user: user.email, User.query.all()))
     # email already exists
-    if email in registred_emails:
-        return {
-                "message": "This email is taken",
-                "statusText": "Email is not unique",
-                "emailErr": True  # highlights the input in red (Frontend)
-               }
+    if __email_is_taken(email):
+        return __email_taken_message
     return None
 
 # in each of the methods below using `data = request.get_json()`
@@ -138,16 +228,25 @@ def register():
         return jsonify(message="Password must be at least 8\u00A0characters", statusText="Improper password", pwErr=True), 400
     try:
         hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
+    except HashingPoolSaturated:
+        raise  # answered by `hashing_pool_saturated()`
     except Exception as e:
         return jsonify(message="Unhashable password", statusText="Inadmissible password", pwErr=True), 500
     # don't hex the uuid [uuid4().hex]: it breaks the ORM database column's type settings
     new_user = User(uuid=uuid4(), name=name, surname=surname, email=email, password=hashed_password)
     try:
         db.session.add(new_user)
+        __queue_email_on_signup(email, name, surname)  # committed with the user
         db.session.commit()
-        # send email on registration
-        executor.submit(__send_email_on_signup, email, name, surname)  # EXECUTOR WORKS IN A SEPARATE THREAD
+        outbox.wake()
+        email_filter = __get_email_filter()
+        if email_filter is not None:
+            email_filter.add(email)
         return jsonify(message="User registered", statusText="Creation successful"), 201
+    except IntegrityError:
+        # the email has been registered concurrently (or through another worker, unknown to its Bloom filter)
+        db.session.rollback()
+        return jsonify(__email_taken_message), 400
     except Exception as e:
         return jsonify(message="Server Error", statusText="Creation failed"), 500
 
@@ -163,13 +262,31 @@ def login():
         return jsonify(message="Required data missing", statusText="Required data missing"), 400
     user = User.query.filter_by(email=email).first()
     if user and bcrypt.check_password_hash(user.password, password):
-        JWToken = create_access_token(identity={'email': user.email})
-        RFToken = create_refresh_token(identity={'email': user.email})
+        # hashes created with a lower cost than the current one are upgraded in the background
+        if bcrypt.needs_rehash(user.password):
+            executor.submit(__upgrade_password_hash, user.id, user.password, password)
+        JWToken = __create_access_token(user)
+        RFToken = create_refresh_token(identity=__token_identity(user))
         return jsonify(JWToken=JWToken, RFToken=RFToken, statusText="Login successful"), 200
     else:
         return jsonify(message="Wrong email or password", statusText="Login failed"), 401
     
 
+def __upgrade_password_hash(user_id, current_hash, password):
+    # EXECUTOR WORKS IN A SEPARATE THREAD
+    try:
+        new_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+    except HashingPoolSaturated:
+        return None  # the next login will retry
+    # the hash is only replaced if the password has not been changed in the meantime
+    db.session.execute(
+        db.update(User)
+        .where(User.id == user_id, User.password == current_hash)
+        .values(password=new_hash)
+    )
+    db.session.commit()
+
+
     # for pw reseting
 def __verify_reset_token(token, expiration=app.config['RESET_PW_TOKEN_EXP']):  # Expires in 15 min.
     try:
@@ -179,17 +296,14 @@ def __verify_reset_token(token, expiration=app.config['RESET_PW_TOKEN_EXP']):  #
         return None
 
 
-def __send_reset_email(email):
+def __queue_reset_email(email):
     token = __generate_reset_token(email)
     reset_url = f"{app.config['FRONTEND_URL']}/reset-password/{token}"
-    message = EmailMessage(
+    enqueue_email(
         subject="VanLife: Password Reset Requested",
-        body=render_template("mail/change_email.html", reset_url=reset_url),
-        from_email="vanlife@support.com",
-        to=[email],
+        body=render_mail("mail/change_email.html", reset_url=reset_url),
+        to=email,
     )
-    message.content_subtype = "html"
-    message.send()
 
 
 @app.route("/sendReset", methods=["POST"])
@@ -200,10 +314,15 @@ def send_reset_email():
     email = str(data.get('email')).lower() if data.get("email") else None
     if not (email):
         return jsonify(message="Required data missing", statusText="Required data missing"), 400
-    registred_emails = list(map(lambda user: user.email, User.query.all()))
-    if email not in registred_emails:
+    # no Bloom filter here: a filter of another worker may not know the email yet
+    if not __email_is_registered(email):
         return jsonify(message="Email is not registred", statusText="Wrong email"), 400
-    __send_reset_email(email=email)
+    try:
+        __queue_reset_email(email=email)
+        db.session.commit()
+    except Exception:
+        return jsonify(message="Server Error", statusText="Failed to send"), 500
+    outbox.wake()  # sent in the background: the response does not wait for the SMTP server
     return jsonify(message="Email sent", statusText="Email sent"), 200
 
 
@@ -250,22 +369,113 @@ def reset_password():
 @app.route("/refreshToken", methods=["POST"])
 @jwt_required(refresh=True)  # `refresh=True` allows only refresh tokens to access this route, not JWTs.
 def refresh():
-    identity = get_jwt_identity()  # NO `EMAIL` key HERE!
-    JWToken = create_access_token(identity=identity)
+    # the claims of the new token are read from the user: a changed name is taken into account; a deleted user is not
+    # refreshed; the refresh tokens issued with an `{"email": ...}` identity get an id-identity access token too
+    identity = get_jwt_identity()
+    try:
+        if "id" in identity:
+            user = db.session.get(User, identity["id"])  # a primary key lookup
+        else:
+            user = User.query.filter_by(email=identity["email"]).first()
+    except (TypeError, KeyError):
+        user = None
+    if not user:
+        return jsonify(message="Not Authorized", statusText="Failed to refresh"), 401
+    JWToken = __create_access_token(user)
     return jsonify(JWToken=JWToken), 200
 
 
+# the basic fields of the logged user; enough for the routes which don't modify the user
+CurrentIdentity = namedtuple("CurrentIdentity", ["id", "uuid", "name", "surname", "email"])
+
+
+# the tokens identify the user by id & uuid, the access tokens carry the other fields of `CurrentIdentity` as claims:
+# the routes reading `__get_current_identity()` do not query the user at all, the others look it up by primary key
+# NOTE: the claims are as of the token's creation (at most JWT_ACCESS_TOKEN_EXPIRES old); `/updateUser` returns a new one
+def __token_identity(user):
+    return {"id": user.id, "uuid": str(user.uuid)}
+
+
+def __create_access_token(user):
+    claims = {"name": user.name, "surname": user.surname, "email": user.email}
+    return create_access_token(identity=__token_identity(user), additional_claims=claims)
+
+
+# token `jti` -> CurrentIdentity; shared by the threads of a worker
+# only the tokens issued with an `{"email": ...}` identity (before the id identities) are resolved through it
+__identity_cache = LRUCache(app.config["IDENTITY_CACHE_SIZE"], ttl=app.config["IDENTITY_CACHE_TTL"]) \
+    if app.config["IDENTITY_CACHE_SIZE"] else None
+
+
+def __forget_cached_identity(user):
+    # must be called when the cached fields of the user change
+    g.pop("current_identity", None)
+    if __identity_cache is not None:
+        __identity_cache.discard_where(lambda jti, identity: identity.id == user.id)
+
+
+@app.teardown_request
+def forget_current_user(exception=None):
+    # `g` may outlive a request (e.g. under the test client); the cached user must not
+    g.pop("current_user", None)
+    g.pop("current_identity", None)
+
+
 @jwt_required()
 def __get_current_user():
     # send in the header of the reuest:: Authentication: `Bearer <JWT>`
-    try:
-        logged_username = get_jwt_identity()['email']
-    except Exception as e:
-        return None  # don't query the user if an exception arises; check for truthness inside view functions;
-    current_user = User.query.filter_by(email=logged_username).first()
+    # the user is resolved once per request
+    if "current_user" in g:
+        return g.current_user
+    token_identity = get_jwt_identity()
+    if isinstance(token_identity, dict) and "id" in token_identity:
+        current_user = db.session.get(User, token_identity["id"])  # a primary key lookup; free if already in the session
+        g.current_user = current_user
+        return current_user
+    identity = g.get("current_identity") or \
+        (__identity_cache.get(get_jwt()["jti"]) if __identity_cache is not None else None)
+    if identity is not None:
+        current_user = db.session.get(User, identity.id)  # a primary key lookup; free if already in the session
+    else:
+        try:
+            logged_username = get_jwt_identity()['email']
+        except Exception as e:
+            return None  # don't query the user if an exception arises; check for truthness inside view functions;
+        current_user = User.query.filter_by(email=logged_username).first()
+    g.current_user = current_user
     return current_user
 
 
+@jwt_required()
+def __get_current_identity():
+    # for the routes that only need the basic fields of the user:
+    # a cached identity saves the user SELECT altogether
+    if "current_identity" in g:
+        return g.current_identity
+    claims = get_jwt()
+    token_identity = claims["sub"]
+    if isinstance(token_identity, dict) and "id" in token_identity:
+        # read from the token: no SELECT
+        identity = CurrentIdentity(
+            token_identity["id"], UUID(token_identity["uuid"]), claims["name"], claims["surname"], claims["email"]
+        )
+        g.current_identity = identity
+        return identity
+    jti = claims["jti"]
+    identity = __identity_cache.get(jti) if __identity_cache is not None else None
+    if identity is None:
+        current_user = __get_current_user()
+        if not current_user:
+            return None
+        identity = CurrentIdentity(
+            current_user.id, current_user.uuid, current_user.name, current_user.surname, current_user.email
+        )
+        if __identity_cache is not None:
+            __identity_cache.set(jti, identity)
+    g.current_identity = identity
+    return identity
+
+
 @app.route('/getUser', methods=['GET'])
 def get_user():
     # no data in the request body;
@@ -274,10 +484,211 @@ def get_user():
     current_user = __get_current_user()
     if not current_user:
         return jsonify(message="Not Authorized", statusText="Failed to read"), 401
-    current_user_json = current_user.to_JSON()
+    current_user_json = current_user.to_profile_JSON()
     return jsonify(logged_user=current_user_json, statusText="Read succesful"), 200
 
 
+def __get_date_arg(name):
+    # raises ValueError on a malformed date; the format is YYYY-MM-DD
+    value = request.args.get(name)
+    return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+
+
+def __get_records_page(model, owner_column, date_column, owner_id):
+    # a page of the logged user's transactions or reviews, newest first;
+    # query parameters (all optional): `from` & `to` (inclusive dates), `cursor`, `limit`
+    # raises ValueError on inadmissible query parameters
+    cursor, limit = __get_page_args(app.config["RECORDS_PAGE_SIZE"], app.config["RECORDS_MAX_PAGE_SIZE"])
+    date_from = __get_date_arg("from")
+    date_to = __get_date_arg("to")
+    query = model.query.filter(owner_column == owner_id)
+    if date_from:
+        query = query.filter(date_column >= date_from)
+    if date_to:
+        query = query.filter(date_column <= date_to)
+    if cursor:
+        # the (date, id) pair of the last record of the previous page
+        last_date, last_id = date.fromisoformat(cursor[0]), __to_sql_int(cursor[1])
+        query = query.filter(db.tuple_(date_column, model.id) < (last_date, last_id))
+    records = query.order_by(date_column.desc(), model.id.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(records) > limit:
+        last_record = records[limit - 1]
+        next_cursor = __encode_cursor(getattr(last_record, date_column.key).isoformat(), last_record.id)
+    return [record.to_JSON() for record in records[:limit]], next_cursor
+
+
+@app.route('/getTransactions', methods=['GET'])
+def get_transactions():
+    current_user = __get_current_identity()
+    if not current_user:
+        return jsonify(message="Not Authorized", statusText="Failed to read"), 401
+    try:
+        transactions, next_cursor = __get_records_page(
+            Transaction, Transaction.lessor_id, Transaction.transaction_date, current_user.id
+        )
+    except (ValueError, TypeError, IndexError):
+        return jsonify(message="Invalid query parameters", statusText="Failed to read"), 400
+    return jsonify(transactions=transactions, nextCursor=next_cursor, statusText="Read successful"), 200
+
+
+@app.route('/getReviews', methods=['GET'])
+def get_reviews():
+    current_user = __get_current_identity()
+    if not current_user:
+        return jsonify(message="Not Authorized", statusText="Failed to read"), 401
+    try:
+        reviews, next_cursor = __get_records_page(
+            Review, Review.owner_id, Review.publication_date, current_user.id
+        )
+    except (ValueError, TypeError, IndexError):
+        return jsonify(message="Invalid query parameters", statusText="Failed to read"), 400
+    return jsonify(reviews=reviews, nextCursor=next_cursor, statusText="Read successful"), 200
+
+
+# HOST DASHBOARD: aggregates computed by the DB (GROUP BY) instead of shipping every row
+@app.route('/host/stats/income', methods=['GET'])
+def get_income_stats():
+    # query parameters (all optional): `from` & `to` (inclusive transaction dates), `period` (`month` or `year`)
+    current_user = __get_current_identity()
+    if not current_user:
+        return jsonify(message="Not Authorized", statusText="Failed to read"), 401
+    period = request.args.get("period", "month")
+    try:
+        date_from = __get_date_arg("from")
+        date_to = __get_date_arg("to")
+    except ValueError:
+        return jsonify(message="Invalid query parameters", statusText="Failed to read"), 400
+    if period not in {"month", "year"}:
+        return jsonify(message="Invalid query parameters", statusText="Failed to read"), 400
+    group_columns = [db.extract("year", Transaction.transaction_date)]
+    if period == "month":
+        group_columns.append(db.extract("month", Transaction.transaction_date))
+    query = db.select(*group_columns, db.func.sum(Transaction.price), db.func.count(Transaction.id)) \
+        .where(Transaction.lessor_id == current_user.id)
+    if date_from:
+        query = query.where(Transaction.transaction_date >= date_from)
+    if date_to:
+        query = query.where(Transaction.transaction_date <= date_to)
+    rows = db.session.execute(query.group_by(*group_columns).order_by(*group_columns)).all()
+    series = [
+        {
+            # "2024" or "2024-05"
+            "period": "-".join(f"{int(value):02d}" for value in row[:len(group_columns)]),
+            "income": int(row[-2]),
+            "bookings": row[-1]
+        }
+        for row in rows
+    ]
+    return jsonify(
+        income=series,
+        totalIncome=sum(point["income"] for point in series),
+        totalBookings=sum(point["bookings"] for point in series),
+        statusText="Read successful"
+    ), 200
+
+
+@app.route('/host/stats/ratings', methods=['GET'])
+def get_rating_stats():
+    # query parameters (all optional): `from` & `to` (inclusive publication dates)
+    current_user = __get_current_identity()
+    if not current_user:
+        return jsonify(message="Not Authorized", statusText="Failed to read"), 401
+    try:
+        date_from = __get_date_arg("from")
+        date_to = __get_date_arg("to")
+    except ValueError:
+        return jsonify(message="Invalid query parameters", statusText="Failed to read"), 400
+    if not (date_from or date_to):
+        # all-time statistics are kept up to date on the user row
+        rating = db.session.get(User, current_user.id).get_rating_JSON()
+        return jsonify(**rating, statusText="Read successful"), 200
+    query = db.select(Review.rate, db.func.count(Review.id)).where(Review.owner_id == current_user.id)
+    if date_from:
+        query = query.where(Review.publication_date >= date_from)
+    if date_to:
+        query = query.where(Review.publication_date <= date_to)
+    histogram = {rate: 0 for rate in range(1, 6)}
+    histogram.update(db.session.execute(query.group_by(Review.rate)).all())
+    count = sum(histogram.values())
+    average = round(sum(rate * number for rate, number in histogram.items()) / count, 2) if count else None
+    return jsonify(histogram=histogram, count=count, average=average, statusText="Read successful"), 200
+
+
+# UPLOADED PICTURES: the request thread only checks the header and parks the file on the disk;
+# the decoding and the renditions (see `images.py`) are left to the executor
+def __claim_image_job(job_key):
+    # one picture job per van/user at a time (per worker): False while the previous one is pending;
+    # the future of a finished job is discarded
+    if executor.futures.done(job_key) is False:
+        return False
+    executor.futures.pop(job_key)
+    return True
+
+
+def __submit_image_job(job_key, process, record_id, upload_path):
+    try:
+        executor.submit_stored(job_key, process, record_id, upload_path)
+        return True
+    except ValueError:
+        # the same key has been claimed concurrently
+        __discard_upload(upload_path)
+        return False
+
+
+def __discard_upload(upload_path):
+    with suppress(FileNotFoundError):
+        os.remove(upload_path)  # e.g. removed with the folder of a deleted van
+
+
+def __save_upload(file, folder):
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    upload_path = os.path.join(folder, f"upload_{uuid4().hex}")
+    file.save(upload_path)
+    return upload_path
+
+
+def __make_renditions(upload_path):
+    # the renditions are written next to the upload, then put into the storage (see `storage.py`);
+    # a picture already stored is neither encoded nor sent again
+    # the picture is acquired (and committed) BEFORE checking whether it is stored: a deletion of its files
+    # (see `models.delete_unreferenced_image()`) either finds it referenced and stops, or is over: the files are put again;
+    # the caller owns the reference: it is assigned to the van/user, or given back with `__discard_image()`
+    # NOTE: a different picture gets different names; this is also the only way to make React images Update without F5
+    scratch_folder = f"{upload_path}_renditions"
+
+    def acquired_and_stored(image):
+        acquire_image(image)
+        db.session.commit()
+        return storage.exists(image)
+
+    try:
+        image = make_renditions(upload_path, scratch_folder, app.config["IMAGE_QUALITY"], is_stored=acquired_and_stored)
+        try:
+            # the full JPEG last: its presence tells that the picture is stored
+            for extensions in rendition_paths(image).values():
+                for extension, key in extensions.items():
+                    scratch_path = os.path.join(scratch_folder, os.path.basename(key))
+                    if os.path.exists(scratch_path):
+                        storage.put(key, scratch_path, CONTENT_TYPES[extension])
+        except Exception:
+            __discard_image(image)
+            raise
+        return image
+    finally:
+        __discard_upload(upload_path)
+        shutil.rmtree(scratch_folder, ignore_errors=True)
+
+
+def __discard_image(image):
+    # gives back the reference acquired by `__make_renditions()` when no van/user takes the picture after all
+    released = release_image(image)
+    db.session.commit()
+    if released:
+        remove_image(image)
+
+
 @app.route('/uploadAvatar', methods=['POST'])
 def upload_avatar():
     current_user = __get_current_user()
@@ -292,40 +703,42 @@ def upload_avatar():
         return jsonify(message="Inadmissible file name", statusText="Invalid file name", imgMsg=True), 400
     if not file_extension in {"jpg", "jpeg", "png"}:
         return jsonify(message="Extension: .png, .jp(e)g", statusText="Invalid file", imgMsg=True), 400
-    
-    # Configure the path to the avatar file and make dir if necessary
-    secure_filename = f"{uuid4().hex}.{file_extension}"
-    user_folder = os.path.join(app.config['STATIC_FOLDER'], "user")
-    personal_folder = os.path.join(user_folder, str(current_user.uuid))
-
-    if not os.path.exists(personal_folder):
-        os.makedirs(personal_folder)
-
-    # Save the new profile picture inside the user folder
-    temp_avatar_path = os.path.join(personal_folder, 'temp_' + secure_filename)
-    final_avatar_path = os.path.join(personal_folder, secure_filename)
-
+    # sniffed while being received; a rejected file has been discarded (see `uploads.py`)
+    if file.stream.rejection:
+        return jsonify(message=file.stream.rejection, statusText="Invalid file", imgMsg=True), 400
+    job_key = f"avatar:{current_user.uuid}"
+    if not __claim_image_job(job_key):
+        return jsonify(message="The previous picture is still being processed", statusText="Upload in progress", imgMsg=True), 409
+    personal_folder = os.path.join(app.config['STATIC_FOLDER'], "user", str(current_user.uuid))
     try:
-        # Save the new file temporarily
-        file.save(temp_avatar_path)
-        current_avatar = current_user.avatar
-        if os.path.exists(current_avatar) and current_avatar != app.config["DEFAULT_USER_IMG"]:
-            os.remove(current_avatar)
-
-        # Rename/move the new file to the final destination
-        os.rename(temp_avatar_path, final_avatar_path)
-        current_user.avatar = final_avatar_path  # update the path to the avatar
-        db.session.commit()
-        return jsonify(
-            message="Profile picture updated", 
-            statusText="Update successful", 
-            imgMsg=True
-        ), 200
-    except Exception as e:
-        # In case of an error, remove the temporary file if it exists
-        if os.path.exists(temp_avatar_path):
-            os.remove(temp_avatar_path)
+        upload_path = __save_upload(file, personal_folder)
+    except Exception:
         return jsonify(message="Server Error", statusText="Failed to update", imgMsg=True), 500
+    if not __submit_image_job(job_key, __process_avatar, current_user.id, upload_path):
+        return jsonify(message="The previous picture is still being processed", statusText="Upload in progress", imgMsg=True), 409
+    # the avatar is replaced once its renditions are ready
+    return jsonify(message="Profile picture uploaded", statusText="Upload successful", imgMsg=True), 202
+
+
+def __process_avatar(user_id, upload_path):
+    # EXECUTOR WORKS IN A SEPARATE THREAD
+    if db.session.get(User, user_id) is None:
+        __discard_upload(upload_path)  # deleted in the meantime: nothing is encoded nor stored
+        return None
+    new_avatar = __make_renditions(upload_path)  # acquired
+    user = db.session.get(User, user_id)
+    if user is None:
+        __discard_image(new_avatar)  # deleted while encoding: the picture is given back
+        return None
+    current_avatar = user.avatar
+    user.avatar = new_avatar
+    # the new picture has been acquired first, so re-uploading the same picture never frees it
+    released = release_image(current_avatar)
+    db.session.commit()
+    __forget_cached_identity(user)  # the cached identities of the user's tokens would show the previous avatar
+    if released:
+        remove_image(current_avatar)
+    return new_avatar
 
 
 @app.route('/updateUser', methods=['PATCH'])
@@ -349,8 +762,12 @@ def update_user():
     current_user.name = name
     current_user.surname = surname
     try:
+        bump_catalog_version()  # the host's name is a part of the Van JSON
         db.session.commit()
-        return jsonify(message="User data updated", statusText="Update successful", userMsg=True), 200
+        __forget_cached_identity(current_user)
+        # a token with the new name & surname; the previous one keeps the old claims until it expires
+        JWToken = __create_access_token(current_user)
+        return jsonify(message="User data updated", statusText="Update successful", userMsg=True, JWToken=JWToken), 200
     except Exception:
         return jsonify(message="Server Error", statusText="Failed to update", userMsg=True), 500
 
@@ -375,30 +792,249 @@ def update_password():
     current_user.password = new_hashed_password
     try:
         db.session.commit()
+        __forget_cached_identity(current_user)
         return jsonify(message="User password updated", statusText="Successful update", passMsg=True), 200
     except Exception:
         return jsonify(message="Server Error", statusText="Failed to update", passMsg=True), 500
 
 
+# keyset pagination: a cursor holds the sort key of the last row of a page;
+# the next page continues right after it, so no OFFSET scanning is involved
+def __encode_cursor(*values):
+    token = urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+    return token.rstrip("=")  # padding is restored on decoding
+
+
+def __decode_cursor(token):
+    # raises ValueError on a malformed token
+    try:
+        values = json.loads(urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except Exception:
+        raise ValueError("Malformed cursor")
+    if not isinstance(values, list):
+        raise ValueError("Malformed cursor")
+    return values
+
+
+def __get_page_args(default_size, max_size):
+    # raises ValueError on inadmissible `cursor` or `limit` query parameters
+    cursor = request.args.get("cursor")
+    cursor = __decode_cursor(cursor) if cursor else None
+    limit = int(request.args.get("limit", default_size))
+    if not 0 < limit <= max_size:
+        raise ValueError("Inadmissible page size")
+    return cursor, limit
+
+
+def __to_sql_int(value):
+    # raises ValueError on a non-integer, or on an integer beyond the SQL INTEGER range (an overflow in the DB otherwise)
+    value = int(value)
+    if not -2_147_483_648 <= value <= 2_147_483_647:
+        raise ValueError("Integer out of range")
+    return value
+
+
+def __get_int_arg(name):
+    # raises ValueError on a non-integer value; `request.args.get(type=int)` would silently ignore it
+    value = request.args.get(name)
+    return __to_sql_int(value) if value is not None else None
+
+
+# CONDITIONAL GET: the catalog responses carry validators derived from the catalog version (see `CatalogVersion`);
+# a client (or the CDN) holding the current version gets a bodyless 304 before any van is loaded;
+# the others are served from the catalog cache (see `catalog_cache.py`) when possible
+def __get_catalog_state():
+    # (version, modified) of the catalog; the presigned image URLs (see `storage.py`) are renewed every window:
+    # a new window counts as a change (the responses embedding the previous URLs are not served anymore)
+    version, modified = get_catalog_version()
+    url_window = storage.url_window
+    if url_window is None:
+        return version, modified
+    return f"{version}.{int(url_window.replace(tzinfo=utc).timestamp())}", max(modified, url_window)
+
+
+def __get_catalog_validators(version, modified):
+    # (strong ETag, Last-Modified)
+    return f"catalog-{version}", utc.localize(modified)
+
+
+def __set_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True  # may be stored, but must be revalidated before each use
+    return response
+
+
+def __get_not_modified_response(etag, last_modified):
+    # None if the client's copy is missing or stale; `If-None-Match` takes precedence over `If-Modified-Since`
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return None
+    return __set_validators(app.response_class(status=304), etag, last_modified)
+
+
+def __get_catalog_response(body, catalog_validators):
+    # `body`: the JSON bytes of the response (see `json_provider.py`)
+    return __set_validators(app.json.response_from_bytes(body), *catalog_validators)
+
+
 @app.route("/vans", methods=["GET"])
 def get_vans():
-    vans = Van.query.all()
-    vans_json_list = list(map(lambda van: van.to_JSON(), vans))
-    return jsonify(vans=vans_json_list, statusText="Read successful"), 200
+    # all query parameters are optional:
+    # `cursor` (`nextCursor` of the previous page), `limit`, `type`, `min_price`, `max_price`,
+    # `available_from` & `available_to` (together; the vans free for the whole rent period, half-open like the rents)
+    try:
+        cursor, limit = __get_page_args(app.config["VANS_PAGE_SIZE"], app.config["VANS_MAX_PAGE_SIZE"])
+        van_type = request.args.get("type")
+        min_price = __get_int_arg("min_price")
+        max_price = __get_int_arg("max_price")
+        available_from = __get_date_arg("available_from")
+        available_to = __get_date_arg("available_to")
+        last_id = __to_sql_int(cursor[0]) if cursor else None
+    except (ValueError, TypeError, IndexError):
+        return jsonify(message="Invalid query parameters", statusText="Failed to read"), 400
+    if van_type is not None and van_type not in Van.types:
+        return jsonify(message="Invalid Van type", statusText="Failed to read"), 400
+    search_by_dates = available_from is not None or available_to is not None
+    if search_by_dates and not (available_from and available_to and available_from < available_to):
+        return jsonify(message="Invalid availability period", statusText="Failed to read"), 400
+    version, modified = __get_catalog_state()
+    if not search_by_dates:
+        # the bookings are not versioned: the date searches are neither validated nor kept in the catalog cache
+        catalog_validators = __get_catalog_validators(version, modified)
+        not_modified = __get_not_modified_response(*catalog_validators)
+        if not_modified:
+            return not_modified
+        catalog_key = f"vans:{last_id}:{limit}:{van_type}:{min_price}:{max_price}"
+        body = catalog_cache.get(version, catalog_key)
+        if body is not None:
+            return __get_catalog_response(body, catalog_validators), 200
+    cache_key = (version, last_id, limit, van_type, min_price, max_price, available_from, available_to)
+    if search_by_dates and available_vans_cache is not None:
+        page = available_vans_cache.get(cache_key)
+        if page is not None:
+            return jsonify(vans=page[0], nextCursor=page[1], statusText="Read successful"), 200
+    query = Van.select_catalog()
+    if search_by_dates:
+        # NOT EXISTS: one anti-join instead of probing the bookings of every van
+        query = query.filter(~van_is_booked(available_from, available_to))
+    if van_type is not None:
+        query = query.filter(Van.type == van_type)
+    if min_price is not None:
+        query = query.filter(Van.price_per_day >= min_price)
+    if max_price is not None:
+        query = query.filter(Van.price_per_day <= max_price)
+    if last_id is not None:
+        query = query.filter(Van.id > last_id)
+    # fetch one extra row to find out whether there is a next page
+    vans = db.session.execute(query.order_by(Van.id).limit(limit + 1)).all()
+    next_cursor = __encode_cursor(vans[limit - 1].id) if len(vans) > limit else None
+    vans_json_list = list(map(Van.row_to_JSON, vans[:limit]))
+    if search_by_dates and available_vans_cache is not None:
+        available_vans_cache.set(cache_key, (vans_json_list, next_cursor))
+    if search_by_dates:
+        return jsonify(vans=vans_json_list, nextCursor=next_cursor, statusText="Read successful"), 200
+    # encoded once, straight to bytes; sent and cached as they are
+    body = app.json.dumps_bytes(dict(vans=vans_json_list, nextCursor=next_cursor, statusText="Read successful"))
+    catalog_cache.set(version, catalog_key, body)
+    return __get_catalog_response(body, catalog_validators), 200
 
 
 @app.route("/vans/<uuid:van_uuid>", methods=["GET"])
 def get_van(van_uuid):
-    van = Van.query.filter_by(uuid=van_uuid).first()
-    if not van:
-        return jsonify(message="Van does not exist", statusText="Failed to read"), 200  # do not return 400; FrontEnd will break
-    van_json = van.to_JSON()
-    return jsonify(van=van_json, statusText="Read successful"), 200
+    version, modified = __get_catalog_state()
+    catalog_validators = __get_catalog_validators(version, modified)
+    body = catalog_cache.get(version, f"van:{van_uuid}")
+    if body is None:
+        van = db.session.execute(Van.select_catalog().where(Van.uuid == van_uuid)).first()
+        if not van:
+            return jsonify(message="Van does not exist", statusText="Failed to read"), 200  # do not return 400; FrontEnd will break
+        van_json = Van.row_to_JSON(van)
+        body = app.json.dumps_bytes(dict(van=van_json, statusText="Read successful"))
+        catalog_cache.set(version, f"van:{van_uuid}", body)  # the missing vans are not cached
+    # the validators are the catalog's: 304 only once the van is known to exist (cached or looked up),
+    # a deleted van would be "not modified" otherwise
+    not_modified = __get_not_modified_response(*catalog_validators)
+    if not_modified:
+        return not_modified
+    return __get_catalog_response(body, catalog_validators), 200
+
+
+# AVAILABILITY CALENDAR: computed from the cached booked periods (see `availability.py`);
+# windows are half-open like the rents: `to` is the first day not covered, i.e. a possible `rentExpiration`
+def __get_availability_window(default_days=None):
+    # raises ValueError on malformed or inadmissible `from` & `to` query parameters
+    today = datetime.now(SERVER_TIMEZONE).date()
+    date_from = __get_date_arg("from") or today
+    date_to = __get_date_arg("to")
+    if date_to is None:
+        if default_days is None:
+            raise ValueError("Missing window end")
+        date_to = date_from + timedelta(days=default_days)
+    if date_to <= date_from or (date_to - date_from).days > app.config["AVAILABILITY_MAX_WINDOW_DAYS"]:
+        raise ValueError("Inadmissible window")
+    # the past cannot be booked (nor is it indexed)
+    return max(date_from, today), max(date_to, today)
+
+
+def __get_ranges_JSON(ranges):
+    return [{"from": start.isoformat(), "to": end.isoformat()} for start, end in ranges]
+
+
+@app.route("/vans/<uuid:van_uuid>/availability", methods=["GET"])
+def get_van_availability(van_uuid):
+    # query parameters (all optional): `from` (today by default) & `to`
+    try:
+        date_from, date_to = __get_availability_window(app.config["AVAILABILITY_WINDOW_DAYS"])
+    except ValueError:
+        return jsonify(message="Invalid query parameters", statusText="Failed to read"), 400
+    van_id = db.session.execute(db.select(Van.id).filter_by(uuid=van_uuid)).scalar()
+    if van_id is None:
+        return jsonify(message="The Van does not exist", statusText="Failed to read"), 404
+    intervals = availability.get(van_id)
+    return jsonify(
+        # the effective window: days before today are cut off
+        availableFrom=date_from.isoformat(),
+        availableTo=date_to.isoformat(),
+        busy=__get_ranges_JSON(intervals.busy(date_from, date_to)),
+        free=__get_ranges_JSON(intervals.free(date_from, date_to)),
+        statusText="Read successful"
+    ), 200
+
+
+@app.route("/vans/availability", methods=["GET"])
+def get_vans_availability():
+    # which vans are free during the whole [from, to) window;
+    # query parameters: `to` (required), `from` (today by default),
+    # `vans` (optional comma-separated van UUIDs; the whole catalog by default)
+    try:
+        date_from, date_to = __get_availability_window()
+        van_uuids = request.args.get("vans")
+        van_uuids = [UUID(van_uuid) for van_uuid in van_uuids.split(",")] if van_uuids else None
+    except ValueError:
+        return jsonify(message="Invalid query parameters", statusText="Failed to read"), 400
+    if van_uuids is not None and len(van_uuids) > app.config["VANS_MAX_PAGE_SIZE"]:
+        return jsonify(message="Too many vans requested", statusText="Failed to read"), 400
+    if van_uuids is None:
+        # the whole catalog: one anti-join in the DB, neither the fleet in the index nor a fleet-long IN list
+        available = db.session.execute(
+            db.select(Van.uuid).where(~van_is_booked(date_from, date_to)).order_by(Van.id)
+        ).scalars().all()
+    else:
+        vans = db.session.execute(db.select(Van.id, Van.uuid).where(Van.uuid.in_(van_uuids)).order_by(Van.id)).all()
+        # at most VANS_MAX_PAGE_SIZE vans; the ones missing from the index are loaded in one query
+        intervals = availability.get_many([van_id for van_id, _ in vans])
+        available = [van_uuid for van_id, van_uuid in vans if not intervals[van_id].overlaps(date_from, date_to)]
+    return jsonify(
+        availableVans=available,
+        availableFrom=date_from.isoformat(),
+        availableTo=date_to.isoformat(),
+        statusText="Read successful"
+    ), 200
 
 
 @app.route("/addVan", methods=["POST"])
 def add_van():
-    current_user = __get_current_user()  # JWT protection is here
+    current_user = __get_current_identity()  # JWT protection is here
     if not current_user:
         return jsonify(message="Not Authorized", statusText="Failed to read"), 401
     data = request.get_json()
@@ -414,7 +1050,7 @@ def add_van():
         return jsonify(message="Name is too long", statusText="Van name too long"), 400
     if len(description) > Van.description_len:
         return jsonify(message="Description is too long", statusText="Description too long"), 400
-    if type not in ["Simple", "Rugged", "Luxury"]:
+    if type not in Van.types:
         return jsonify(message="Invalid Van type", statusText="Invalid input", dataMsg=True), 400
     try:
         price_per_day = int(price_per_day)
@@ -435,6 +1071,7 @@ def add_van():
     )
     try:
         db.session.add(van)
+        bump_catalog_version()
         db.session.commit()
         # NOTE: 'success' field is needed for redirecting inside AddVanPage's loader
         return jsonify(message="Van created", statusText="Create successful", dataMsg=True, success=True), 201
@@ -444,7 +1081,7 @@ def add_van():
 
 @app.route('/uploadVanImage', methods=['POST'])
 def upload_van_image():
-    current_user = __get_current_user()  # jwt-protection is here
+    current_user = __get_current_identity()  # jwt-protection is here
     if not current_user:
         return jsonify(message="Not Authorized", statusText="Failed to read"), 401
     vanUUID = request.form.get("vanUUID", None)  # vanUUID is a string
@@ -462,45 +1099,47 @@ def upload_van_image():
         return jsonify(message="Inadmissible file name", statusText="Invalid file name", imgMsg=True), 400
     if not file_extension in {"jpg", "jpeg", "png"}:
         return jsonify(message="Extension: .png, .jp(e)g", statusText="Invalid file", imgMsg=True), 400
-    
-    # Configure the path to the avatar file and make dir if necessary
-    #
-    # NOTE: dynamic names is also the only way to make React images Update without F5
-    secure_filename = f"{uuid4().hex}.{file_extension}"
-    vans_folder = os.path.join(app.config['STATIC_FOLDER'], "vans")
-    personal_folder = os.path.join(vans_folder, str(van.uuid))
+    # sniffed while being received; a rejected file has been discarded (see `uploads.py`)
+    if file.stream.rejection:
+        return jsonify(message=file.stream.rejection, statusText="Invalid file", imgMsg=True), 400
+    job_key = f"van_image:{van.uuid}"
+    if not __claim_image_job(job_key):
+        return jsonify(message="The previous image is still being processed", statusText="Upload in progress", imgMsg=True), 409
+    personal_folder = os.path.join(app.config['STATIC_FOLDER'], "vans", str(van.uuid))
+    try:
+        upload_path = __save_upload(file, personal_folder)
+    except Exception:
+        return jsonify(message="Server Error", statusText="Failed to update", imgMsg=True), 500
+    if not __submit_image_job(job_key, __process_van_image, van.id, upload_path):
+        return jsonify(message="The previous image is still being processed", statusText="Upload in progress", imgMsg=True), 409
+    # the image is replaced once its renditions are ready
+    return jsonify(message="Image uploaded", statusText="Upload successful", imgMsg=True), 202
 
-    if not os.path.exists(personal_folder):
-        os.makedirs(personal_folder)
 
-    # preliminary and final names of the file (to delete an old image first, but only on success)
-    temp_image_path = os.path.join(personal_folder, 'temp_' + secure_filename)
-    final_image_path = os.path.join(personal_folder, secure_filename)
+def __process_van_image(van_id, upload_path):
+    # EXECUTOR WORKS IN A SEPARATE THREAD
+    if db.session.get(Van, van_id) is None:
+        __discard_upload(upload_path)  # deleted in the meantime (the upload with its folder): nothing is encoded nor stored
+        return None
+    new_image = __make_renditions(upload_path)  # acquired
+    van = db.session.get(Van, van_id)
+    if van is None:
+        __discard_image(new_image)  # deleted while encoding: the picture is given back
+        return None
     current_image = van.image
-    try:
-        # Save the new file temporarily
-        file.save(temp_image_path)
-        # don't delete the default image from the folder
-        if os.path.exists(current_image) and current_image != app.config["DEFAULT_VANS_IMG"]:
-            os.remove(current_image)
-
-        # Rename/move the new file to the final destination
-        os.rename(temp_image_path, final_image_path)
-        van.image = final_image_path  # update the path to the van image
-        db.session.commit()
-        return jsonify(message="Image updated", statusText="Update successful", imgMsg=True), 200
-    except Exception as e:
-        # In case of an error, remove the temporary file if it exists
-        if os.path.exists(temp_image_path):
-            os.remove(temp_image_path)
-            van.image = current_image
-            db.session.commit()
-        return jsonify(message="Server Error", statusText="Failed to update", imgMsg=True), 500
+    van.image = new_image
+    # the new image has been acquired first, so re-uploading the same image never frees it
+    released = release_image(current_image)  # never the default image
+    bump_catalog_version()
+    db.session.commit()
+    if released:
+        remove_image(current_image)
+    return new_image
 
 
 @app.route('/updateVan', methods=['PATCH'])
 def update_van():
-    current_user = __get_current_user()  # JWT protection is here
+    current_user = __get_current_identity()  # JWT protection is here
     if not current_user:
         return jsonify(message="Not Authorized", statusText="Failed to read"), 401
     data = request.get_json()
@@ -524,7 +1163,7 @@ def update_van():
         return jsonify(message="Name is too long", statusText="Van name too long"), 400
     if len(description) > Van.description_len:
         return jsonify(message="Description is too long", statusText="Description too long"), 400
-    if type not in ["Simple", "Rugged", "Luxury"]:
+    if type not in Van.types:
         return jsonify(message="Invalid Van type", statusText="Wrong input", dataMsg=True), 400
     try:
         price_per_day = int(price_per_day)
@@ -549,6 +1188,7 @@ def update_van():
     van.price_per_day = price_per_day
     van.type = type
     try:
+        bump_catalog_version()
         db.session.commit()
         return jsonify(message="Van data updated", statusText="Update successful", dataMsg=True), 200
     except Exception:
@@ -557,7 +1197,7 @@ def update_van():
 
 @app.route('/deleteVan', methods=['DELETE'])
 def delete_van():
-    current_user = __get_current_user()  # JWT protection is here
+    current_user = __get_current_identity()  # JWT protection is here
     if not current_user:
         return jsonify(message="Not Authorized", statusText="Failed to read"), 401
     data = request.get_json()
@@ -571,9 +1211,14 @@ def delete_van():
     van_static_folder = os.path.join(app.config['STATIC_FOLDER'], "vans", vanUUID)
     try:
         if os.path.exists(van_static_folder):
-            shutil.rmtree(van_static_folder)  # delete everything inside the folder & the folder
+            shutil.rmtree(van_static_folder)  # pending uploads & pre-store renditions; the folder
+        released = release_image(van.image)
         db.session.delete(van)
+        bump_catalog_version()
         db.session.commit()
+        if released:
+            remove_image(van.image)  # the last van showing this image
+        availability.invalidate(van.id)
         # NOTE: 'success' field is needed for redirecting inside VanDeletePage's loader
         return jsonify(message="Van deleted", statusText="Delete successful", success=True), 200
     except Exception:
@@ -642,22 +1287,37 @@ def make_transaction():
     correct_price = (rent_expiration - rent_commencement).days * van.price_per_day
     if price != correct_price:
         return jsonify(message="Price miscalculated", statusText="Wrong price"), 400
+    # the cached index turns most of the conflicting requests away without querying the DB
+    if availability.get(van.id).overlaps(rent_commencement, rent_expiration):
+        return jsonify(message="The Van is not available for these dates", statusText="Van not available"), 409
     try:
-        transaction = Transaction(
-            uuid=uuid4(), 
-            lessee_name=lessee_name,
-            lessee_surname=lessee_surname,
-            lessee_email=lessee_email,
-            price=price,
-            rent_commencement=rent_commencement,
-            rent_expiration=rent_expiration,
-            lessor_id=van.host_id,
-            van_id=van.id
-        )
-        db.session.add(transaction)
-        db.session.commit()
+        with booking_lock(van.id):
+            # the index may miss the bookings made through other workers: the DB has the final word
+            if overlapping_transactions(van.id, rent_commencement, rent_expiration).first():
+                availability.invalidate(van.id)
+                return jsonify(message="The Van is not available for these dates", statusText="Van not available"), 409
+            transaction = Transaction(
+                uuid=uuid4(), 
+                lessee_name=lessee_name,
+                lessee_surname=lessee_surname,
+                lessee_email=lessee_email,
+                price=price,
+                rent_commencement=rent_commencement,
+                rent_expiration=rent_expiration,
+                lessor_id=van.host_id,
+                van_id=van.id
+            )
+            db.session.add(transaction)
+            db.session.commit()
+        availability.invalidate(van.id)
+        forget_available_vans()
         # NOTE: 'success' field is needed for redirecting inside MakeTransaction's loader
         return jsonify(message="Transaction created", statusText="Create successful", success=True), 201
+    except IntegrityError:
+        # PostgreSQL: violation of the `transaction_van_period_excl` exclusion constraint
+        db.session.rollback()
+        availability.invalidate(van.id)
+        return jsonify(message="The Van is not available for these dates", statusText="Van not available"), 409
     except Exception:
         return jsonify(message="Server Error", statusText="Failed to delete"), 500
 
@@ -700,6 +1360,8 @@ def make_review():
             van_uuid=van.uuid
         )
         db.session.add(review)
+        apply_review_rating(review)
+        bump_catalog_version()  # the van's rating is a part of the Van JSON
         db.session.commit()
         # NOTE: 'success' field is needed for redirecting inside MakeReview's loader
         return jsonify(message="Review created", statusText="Create successful", success=True), 201
@@ -708,6 +1370,25 @@ def make_review():
         return jsonify(message="Server Error", statusText="Failed to create"), 500
 
 
+# `flask --app main rebuild-ratings`
+@app.cli.command("rebuild-ratings")
+def rebuild_ratings():
+    rebuild_rating_summaries()
+    click.echo("Rating summaries rebuilt")
+
+
+# the counters of the asyncio mail worker (see `mail_worker.py`); behind the admin login (see `protect_admin()`)
+@app.route('/admin/mailStats')
+def mail_stats():
+    return jsonify(**mail_worker.stats(), statusText="Read successful"), 200
+
+
+# `flask --app main requeue-emails`
+@app.cli.command("requeue-emails")
+def requeue_emails():
+    click.echo(f"{requeue_dead_emails()} dead-lettered emails re-queued")
+
+
 if __name__ == "__main__":
     with app.app_context():
         db.create_all()  # spin up a DB if it does not exist already
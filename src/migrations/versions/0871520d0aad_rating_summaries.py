@@ -0,0 +1,44 @@
+"""rating summaries
+
+Revision ID: 0871520d0aad
+Revises: ae694705ce1b
+Create Date: 2026-10-17 20:01:32.138686
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0871520d0aad'
+down_revision = 'ae694705ce1b'
+branch_labels = None
+depends_on = None
+
+RATING_COLUMNS = ['rating_sum', 'rating_count', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5']
+
+
+def upgrade():
+    for table in ('user', 'van'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for column in RATING_COLUMNS:
+                batch_op.add_column(sa.Column(column, sa.Integer(), server_default='0', nullable=False))
+    # backfill from the existing reviews (same as `models.rebuild_rating_summaries()`)
+    for table, owner_column in (('"user"', 'owner_id'), ('van', 'van_id')):
+        aggregates = {
+            'rating_sum': 'SUM(rate)',
+            'rating_count': 'COUNT(id)',
+            **{f'rating_{rate}': f'SUM(CASE WHEN rate = {rate} THEN 1 ELSE 0 END)' for rate in range(1, 6)}
+        }
+        assignments = ', '.join(
+            f'{column} = (SELECT COALESCE({aggregate}, 0) FROM review WHERE review.{owner_column} = {table}.id)'
+            for column, aggregate in aggregates.items()
+        )
+        op.execute(f'UPDATE {table} SET {assignments}')
+
+
+def downgrade():
+    for table in ('van', 'user'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for column in reversed(RATING_COLUMNS):
+                batch_op.drop_column(column)
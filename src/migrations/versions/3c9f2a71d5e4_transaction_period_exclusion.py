@@ -0,0 +1,48 @@
+"""transaction period exclusion
+
+Revision ID: 3c9f2a71d5e4
+Revises: 0871520d0aad
+Create Date: 2026-10-17 21:12:47.503118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c9f2a71d5e4'
+down_revision = '0871520d0aad'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # PostgreSQL only: two rents of the same van can never overlap, whatever the application does
+    # (other backends rely on `availability.booking_lock()` in /makeTransaction)
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    # the rents overlapping already would fail the constraint: listed, to be resolved (cancelled, moved) by hand first
+    overlapping = op.get_bind().execute(sa.text(
+        'SELECT a.van_id, a.id, a.rent_commencement, a.rent_expiration, b.id, b.rent_commencement, b.rent_expiration '
+        'FROM "transaction" a JOIN "transaction" b ON a.van_id = b.van_id AND a.id < b.id '
+        'AND daterange(a.rent_commencement, a.rent_expiration) && daterange(b.rent_commencement, b.rent_expiration) '
+        'ORDER BY a.van_id, a.id, b.id'
+    )).all()
+    if overlapping:
+        raise RuntimeError(
+            f'{len(overlapping)} pair(s) of overlapping rents; resolve them, then upgrade again:\n' + '\n'.join(
+                f'  van {van_id}: transaction {a_id} [{a_start}, {a_end}) & transaction {b_id} [{b_start}, {b_end})'
+                for van_id, a_id, a_start, a_end, b_id, b_start, b_end in overlapping
+            )
+        )
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    op.execute(
+        'ALTER TABLE "transaction" ADD CONSTRAINT transaction_van_period_excl '
+        'EXCLUDE USING gist (van_id WITH =, daterange(rent_commencement, rent_expiration) WITH &&)'
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('ALTER TABLE "transaction" DROP CONSTRAINT transaction_van_period_excl')
@@ -0,0 +1,33 @@
+"""catalog version
+
+Revision ID: 7e21b4d09c3a
+Revises: 3c9f2a71d5e4
+Create Date: 2026-10-17 22:04:15.870342
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7e21b4d09c3a'
+down_revision = '3c9f2a71d5e4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    catalog_version = op.create_table('catalog_version',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('modified', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    # the single row (see `models.CatalogVersion`)
+    op.bulk_insert(catalog_version, [{'id': 1, 'version': 1, 'modified': datetime.utcnow().replace(microsecond=0)}])
+
+
+def downgrade():
+    op.drop_table('catalog_version')
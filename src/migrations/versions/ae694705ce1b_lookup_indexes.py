@@ -0,0 +1,32 @@
+"""lookup indexes
+
+Revision ID: ae694705ce1b
+Revises: 155924bcca66
+Create Date: 2026-10-17 19:53:01.711879
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'ae694705ce1b'
+down_revision = '155924bcca66'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # `van.uuid` and `user.email` are UNIQUE, hence already indexed
+    op.create_index('ix_van_host_id', 'van', ['host_id'], unique=False)
+    op.create_index('ix_transaction_lessor_id_transaction_date', 'transaction', ['lessor_id', 'transaction_date'], unique=False)
+    op.create_index('ix_transaction_van_id_rent_commencement', 'transaction', ['van_id', 'rent_commencement', 'rent_expiration'], unique=False)
+    op.create_index('ix_review_owner_id_publication_date', 'review', ['owner_id', 'publication_date'], unique=False)
+    op.create_index('ix_review_van_id_publication_date', 'review', ['van_id', 'publication_date'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_review_van_id_publication_date', table_name='review')
+    op.drop_index('ix_review_owner_id_publication_date', table_name='review')
+    op.drop_index('ix_transaction_van_id_rent_commencement', table_name='transaction')
+    op.drop_index('ix_transaction_lessor_id_transaction_date', table_name='transaction')
+    op.drop_index('ix_van_host_id', table_name='van')
@@ -0,0 +1,30 @@
+"""image blob
+
+Revision ID: b8f3d61e2a45
+Revises: 7e21b4d09c3a
+Create Date: 2026-10-17 23:41:08.215934
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8f3d61e2a45'
+down_revision = '7e21b4d09c3a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the reference counts of the image store (see `models.ImageBlob`); the pictures uploaded before keep their paths
+    op.create_table('image_blob',
+    sa.Column('key', sa.String(length=64), nullable=False),
+    sa.Column('refcount', sa.Integer(), nullable=False),
+    sa.Column('created', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('key')
+    )
+
+
+def downgrade():
+    op.drop_table('image_blob')
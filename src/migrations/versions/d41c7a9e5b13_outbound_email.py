@@ -0,0 +1,43 @@
+"""outbound email
+
+Revision ID: d41c7a9e5b13
+Revises: b8f3d61e2a45
+Create Date: 2026-10-18 09:12:47.604281
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41c7a9e5b13'
+down_revision = 'b8f3d61e2a45'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the outbox (see `outbox.py`)
+    op.create_table('outbound_email',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('subject', sa.String(length=255), nullable=False),
+    sa.Column('body', sa.Text(), nullable=False),
+    sa.Column('subtype', sa.String(length=10), nullable=False),
+    sa.Column('from_email', sa.String(length=320), nullable=False),
+    sa.Column('to', sa.String(length=320), nullable=False),
+    sa.Column('status', sa.String(length=10), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('next_attempt', sa.DateTime(), nullable=False),
+    sa.Column('claim', sa.String(length=32), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created', sa.DateTime(), nullable=False),
+    sa.Column('sent', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    # the due emails are looked up by the dispatchers
+    op.create_index('ix_outbound_email_status_next_attempt', 'outbound_email', ['status', 'next_attempt'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_outbound_email_status_next_attempt', table_name='outbound_email')
+    op.drop_table('outbound_email')
@@ -6,11 +6,37 @@ from datetime import datetime
 from flask import abort, redirect, session
 from flask_admin.contrib.sqla import ModelView
 
+# other 3rd party
+from pytz import utc
+from sqlalchemy import DDL, event
+from sqlalchemy.dialects.postgresql import ExcludeConstraint
+
 # project
 from config import app, admin, db, SERVER_TIMEZONE
+from images import blob_key
+from storage import image_url, image_urls, remove_image
+
+
+class RatingSummary:
+    # denormalized review statistics of a van or a host: the ratings are served without scanning the reviews;
+    # kept up to date by `apply_review_rating()` in the same DB transaction as the review itself
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_1 = db.Column(db.Integer, nullable=False, default=0, server_default="0")  # number of 1-star reviews
+    rating_2 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_3 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_4 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_5 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
+    def get_rating_JSON(self):
+        return {
+                "average": round(self.rating_sum / self.rating_count, 2) if self.rating_count else None,
+                "count": self.rating_count,
+                "histogram": {rate: getattr(self, f"rating_{rate}") for rate in range(1, 6)}
+                }
 
 
-class User(db.Model):
+class User(RatingSummary, db.Model):
 
     name_len = 40
     surname_len = 40
@@ -40,17 +66,39 @@ class User(db.Model):
                 "name": self.name,
                 "surname": self.surname,
                 "email": self.email,
-                "avatar": self.avatar,
+                "avatar": image_url(self.avatar),
+                "avatarRenditions": image_urls(self.avatar),
                 "vans": [van.to_JSON() for van in self.vans],
                 "transactions": [transaction.to_JSON() for transaction in self.transactions],
                 "reviews": [review.to_JSON() for review in self.reviews]
                 }
 
+    def to_profile_JSON(self):
+        # a slim `to_JSON()`: the transactions and reviews are only counted (with index-only scans);
+        # they are served page by page by `/getTransactions` and `/getReviews`
+        def count(model, owner_column):
+            return db.session.scalar(db.select(db.func.count(model.id)).where(owner_column == self.id))
+
+        return {
+                "id": self.id,
+                "uuid": self.uuid,
+                "name": self.name,
+                "surname": self.surname,
+                "email": self.email,
+                "avatar": image_url(self.avatar),
+                "avatarRenditions": image_urls(self.avatar),
+                "vans": [van.to_JSON() for van in self.vans],
+                "transactionsCount": count(Transaction, Transaction.lessor_id),
+                "reviewsCount": count(Review, Review.owner_id),
+                "rating": self.get_rating_JSON()
+                }
+
 
-class Van(db.Model):
+class Van(RatingSummary, db.Model):
 
     name_len = 60
     description_len = 1500
+    types = ("Simple", "Rugged", "Luxury")
 
     id = db.Column(db.Integer, primary_key=True)
     uuid = db.Column(db.UUID, unique=True, nullable=False)
@@ -59,7 +107,7 @@ class Van(db.Model):
     description = db.Column(db.String(description_len), nullable=False)
     price_per_day = db.Column(db.Integer, nullable=False)
     image = db.Column(db.String, default=app.config["DEFAULT_VANS_IMG"], nullable=False)
-    host_id = db.Column(db.Integer, db.ForeignKey("user.id"), name="host_id")
+    host_id = db.Column(db.Integer, db.ForeignKey("user.id"), name="host_id", index=True)
     transactions = db.relationship("Transaction", backref="van", lazy=True)
     reviews = db.relationship("Review", backref="van", lazy=True)
 
@@ -67,7 +115,9 @@ class Van(db.Model):
         return f"{self.name} {self.type}"
     
     def __get_host_data(self):
-        host = User.query.get(self.host_id)
+        # `host` is the backref of `User.vans`; it costs no query if the host has been eager-loaded
+        # or is already in the session's identity map
+        host = self.host
         return {"full_name": host.get_full_name(), "email": host.email}
 
     def to_JSON(self):
@@ -78,12 +128,57 @@ class Van(db.Model):
                 "pricePerDay": self.price_per_day,
                 "description": self.description,
                 "type": self.type,
-                "image": self.image,
-                "host": self.__get_host_data()
+                "image": image_url(self.image),
+                "imageRenditions": image_urls(self.image),
+                "host": self.__get_host_data(),
+                "rating": self.get_rating_JSON()
+                }
+
+    # COMPACT PATH for the catalog: plain rows instead of ORM instances (the attribute instrumentation
+    # dominates the serialization of large pages); `row_to_JSON()` yields exactly the JSON of `to_JSON()`
+    @classmethod
+    def select_catalog(cls):
+        # the columns read by `to_JSON()`, the host's included, in a single SELECT
+        return db.select(
+            cls.id, cls.uuid, cls.name, cls.price_per_day, cls.description, cls.type, cls.image,
+            cls.rating_sum, cls.rating_count, cls.rating_1, cls.rating_2, cls.rating_3, cls.rating_4, cls.rating_5,
+            User.name.label("host_name"), User.surname.label("host_surname"), User.email.label("host_email")
+        ).join(User, User.id == cls.host_id)
+
+    @staticmethod
+    def row_to_JSON(row):
+        # `row`: a row of `select_catalog()`
+        return {
+                "id": row.id,
+                "uuid": row.uuid,
+                "name": row.name,
+                "pricePerDay": row.price_per_day,
+                "description": row.description,
+                "type": row.type,
+                "image": image_url(row.image),
+                "imageRenditions": image_urls(row.image),
+                "host": {"full_name": f"{row.host_name} {row.host_surname}", "email": row.host_email},
+                "rating": {
+                    "average": round(row.rating_sum / row.rating_count, 2) if row.rating_count else None,
+                    "count": row.rating_count,
+                    "histogram": {1: row.rating_1, 2: row.rating_2, 3: row.rating_3, 4: row.rating_4, 5: row.rating_5}
+                    }
                 }
 
 
 class Transaction(db.Model):
+    # `uuid` and `User.email` are UNIQUE, hence already indexed;
+    # the indexes below serve the per-host listings (newest first) and the per-van rent periods
+    # PostgreSQL only: two rents of the same van can never overlap, whatever the application does
+    # (`daterange()` is half-open, like the rents; other backends rely on `availability.booking_lock()`)
+    __table_args__ = (
+        db.Index("ix_transaction_lessor_id_transaction_date", "lessor_id", "transaction_date"),
+        db.Index("ix_transaction_van_id_rent_commencement", "van_id", "rent_commencement", "rent_expiration"),
+        ExcludeConstraint(
+            ("van_id", "="), (db.func.daterange(db.column("rent_commencement"), db.column("rent_expiration")), "&&"),
+            using="gist", name="transaction_van_period_excl"
+        ).ddl_if(dialect="postgresql"),
+    )
 
     name_len = 40
     surname_len = 40
@@ -126,7 +221,18 @@ class Transaction(db.Model):
                 }
 
 
+# `van_id WITH =` in the GiST exclusion constraint needs the `btree_gist` extension (`db.create_all()`; see the migration)
+event.listen(
+    Transaction.__table__, "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS btree_gist").execute_if(dialect="postgresql")
+)
+
+
 class Review(db.Model):
+    __table_args__ = (
+        db.Index("ix_review_owner_id_publication_date", "owner_id", "publication_date"),
+        db.Index("ix_review_van_id_publication_date", "van_id", "publication_date"),
+    )
 
     author_len = 40
     text_len=512
@@ -159,6 +265,148 @@ class Review(db.Model):
                 }
 
 
+class CatalogVersion(db.Model):
+    # a single row, bumped by every change of the data served by `/vans` and `/vans/<uuid>`;
+    # the catalog responses are validated against it (ETag & Last-Modified) without loading any van
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    modified = db.Column(db.DateTime, nullable=False)  # UTC, whole seconds (like the `Last-Modified` header)
+
+
+def __utc_now():
+    return datetime.now(utc).replace(tzinfo=None, microsecond=0)
+
+
+def bump_catalog_version():
+    # call BEFORE committing a change of the catalog: the bump is committed (or rolled back) together with it;
+    # `version = version + 1` is atomic: concurrent bumps are never lost
+    modified = __utc_now()
+    bumped = db.session.execute(
+        db.update(CatalogVersion).where(CatalogVersion.id == 1)
+        .values(version=CatalogVersion.version + 1, modified=modified)
+    ).rowcount
+    if not bumped:
+        db.session.add(CatalogVersion(id=1, version=1, modified=modified))
+
+
+def get_catalog_version():
+    # (version, modified); a primary key lookup
+    catalog_version = db.session.execute(
+        db.select(CatalogVersion.version, CatalogVersion.modified).where(CatalogVersion.id == 1)
+    ).first()
+    if catalog_version is None:
+        # an empty table (e.g. the catalog has never changed since `db.create_all()`)
+        return 0, datetime(1970, 1, 1)
+    return tuple(catalog_version)
+
+
+class ImageBlob(db.Model):
+    # a picture of the image store (see `images.py`) and the number of vans/users showing it
+    key = db.Column(db.String(64), primary_key=True)  # SHA-256, hex
+    refcount = db.Column(db.Integer, nullable=False, default=0)
+    created = db.Column(db.DateTime, nullable=False)  # UTC
+
+
+class OutboundEmail(db.Model):
+    # the outbox (see `outbox.py`): an email is queued in the transaction that calls for it, then sent in the background
+    statuses = ("pending", "sent", "dead")  # dead: given up after OUTBOX_MAX_ATTEMPTS (the error is kept)
+    #
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    subtype = db.Column(db.String(10), nullable=False, default="html")  # `EmailMessage.content_subtype`
+    from_email = db.Column(db.String(320), nullable=False)
+    to = db.Column(db.String(320), nullable=False)
+    status = db.Column(db.String(10), nullable=False, default="pending")
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    # when a pending email may be (re)tried: the retry backoff, or the lease of the dispatcher sending it (UTC)
+    next_attempt = db.Column(db.DateTime, nullable=False)
+    claim = db.Column(db.String(32), nullable=True)  # the batch that has claimed it last
+    last_error = db.Column(db.Text, nullable=True)
+    created = db.Column(db.DateTime, nullable=False)  # UTC
+    sent = db.Column(db.DateTime, nullable=True)  # UTC
+    #
+    __table_args__ = (db.Index("ix_outbound_email_status_next_attempt", "status", "next_attempt"),)
+
+
+def acquire_image(image_path):
+    # call BEFORE committing the assignment of `image_path` to a van/user: committed (or rolled back) together;
+    # a row released to 0 (its files about to be deleted, see `storage.remove_image()`) is taken back
+    key = blob_key(image_path)
+    if key is None:
+        return  # e.g. the default image
+    acquired = db.session.execute(
+        db.update(ImageBlob).where(ImageBlob.key == key).values(refcount=ImageBlob.refcount + 1)
+    ).rowcount
+    if not acquired:
+        db.session.add(ImageBlob(key=key, refcount=1, created=__utc_now()))
+
+
+def release_image(image_path):
+    # call BEFORE committing the replacement/deletion of the van/user showing `image_path`;
+    # True if its files are to be removed AFTER the commit: the last reference of a blob, or a pre-store picture
+    # NOTE: the row of a blob is kept (refcount 0): it is deleted with the files, if still unreferenced by then
+    if image_path in (app.config["DEFAULT_VANS_IMG"], app.config["DEFAULT_USER_IMG"]):
+        return False
+    key = blob_key(image_path)
+    if key is None:
+        return True  # a picture uploaded before the store: never shared
+    db.session.execute(
+        db.update(ImageBlob).where(ImageBlob.key == key).values(refcount=ImageBlob.refcount - 1)
+    )
+    refcount = db.session.execute(db.select(ImageBlob.refcount).where(ImageBlob.key == key)).scalar()
+    return refcount is not None and refcount <= 0
+
+
+def delete_unreferenced_image(key, delete_files):
+    # deletes the row of a released blob and, before committing, its files (`delete_files()`); nothing if the blob has
+    # been acquired again in the meantime; the row lock (SQLite: the write lock) is held until the files are gone:
+    # a concurrent `acquire_image()` waits, finds no row, and its upload puts the files again (see `__make_renditions()`)
+    # returns whether the blob has been deleted
+    deleted = db.session.execute(
+        db.delete(ImageBlob).where(ImageBlob.key == key, ImageBlob.refcount <= 0)
+    ).rowcount
+    if not deleted:
+        db.session.rollback()
+        return False
+    try:
+        delete_files()
+    except Exception:
+        db.session.rollback()  # the row stays unreferenced: deleted with the files by the next release
+        raise
+    db.session.commit()
+    return True
+
+
+def apply_review_rating(review, sign=1):
+    # adds (sign=1) or removes (sign=-1) the review's rate to/from the summaries of its van and host;
+    # `column = column + delta` UPDATEs are atomic: concurrent reviews don't overwrite each other's counts
+    def delta(model):
+        return {
+                "rating_sum": model.rating_sum + sign * review.rate,
+                "rating_count": model.rating_count + sign,
+                f"rating_{review.rate}": getattr(model, f"rating_{review.rate}") + sign
+                }
+    db.session.execute(db.update(Van).where(Van.id == review.van_id).values(**delta(Van)))
+    db.session.execute(db.update(User).where(User.id == review.owner_id).values(**delta(User)))
+
+
+def rebuild_rating_summaries():
+    # recomputes every summary from the reviews (e.g. to fix a drift); runs in a couple of set-based UPDATEs
+    for model, owner_column in ((Van, Review.van_id), (User, Review.owner_id)):
+        def aggregate(expression):
+            return db.select(db.func.coalesce(expression, 0)).where(owner_column == model.id).scalar_subquery()
+        values = {
+                  "rating_sum": aggregate(db.func.sum(Review.rate)),
+                  "rating_count": aggregate(db.func.count(Review.id))
+                  }
+        for rate in range(1, 6):
+            values[f"rating_{rate}"] = aggregate(db.func.sum(db.case((Review.rate == rate, 1), else_=0)))
+        db.session.execute(db.update(model).values(**values))
+    bump_catalog_version()  # the vans' ratings may have changed
+    db.session.commit()
+
+
 class BasicView(ModelView):
     # UUIDs not visible in standard ADMIN page
     can_create = False  # without UUID there's no way to create
@@ -179,14 +427,42 @@ class UserView(BasicView):
 class VanView(BasicView):
     can_delete = True
 
+    def on_model_delete(self, model):
+        # committed by Flask-Admin together with the deletion
+        bump_catalog_version()
+        model.image_released = release_image(model.image)
+
+    def after_model_delete(self, model):
+        from availability import availability  # `availability` imports this module
+        availability.invalidate(model.id)
+        if model.image_released:
+            remove_image(model.image)
+
 class TransactionView(BasicView):
     can_delete = True
 
+    def after_model_delete(self, model):
+        from availability import availability, forget_available_vans  # `availability` imports this module
+        availability.invalidate(model.van_id)
+        forget_available_vans()
+
 class ReviewView(BasicView):
     can_delete = True
 
+    def on_model_delete(self, model):
+        # committed by Flask-Admin together with the deletion
+        apply_review_rating(model, sign=-1)
+        bump_catalog_version()
+
+class OutboundEmailView(BasicView):
+    # the dead letters can be inspected, deleted, or re-queued with `flask --app main requeue-emails`
+    can_delete = True
+    column_exclude_list = ("body",)
+    column_filters = ("status",)
+
 
 admin.add_view(UserView(User, db.session))
 admin.add_view(VanView(Van, db.session))
 admin.add_view(TransactionView(Transaction, db.session))
 admin.add_view(ReviewView(Review, db.session))
+admin.add_view(OutboundEmailView(OutboundEmail, db.session))
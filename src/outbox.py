@@ -0,0 +1,179 @@
+# standard library
+from datetime import datetime, timedelta, timezone
+from threading import Event, Lock, Thread
+from uuid import uuid4
+
+# 3rd party flask
+from flask_mailman import EmailMessage
+
+# project
+from config import app, db, mail
+from mail_worker import mail_worker
+from models import OutboundEmail
+
+
+# OUTBOX: the routes never talk to the SMTP server; an email is a row queued in the transaction that calls for it
+# (e.g. the registration: no email for a rolled back user, no user without its email), then committed;
+# a dispatcher thread per worker claims the due emails in batches and sends each batch over one SMTP connection,
+# or over the pool of connections kept open by the asyncio mail worker (see `mail_worker.py`)
+#
+# a failed email is retried after OUTBOX_RETRY_DELAY seconds, doubled after every failure; after OUTBOX_MAX_ATTEMPTS
+# it is dead-lettered (`status = "dead"`, the last error is kept: see the admin panel, `flask --app main requeue-emails`)
+# NOTE: the delivery is at-least-once: an email sent by a worker killed before committing is sent again after the lease
+
+FROM_EMAIL = "vanlife@support.com"
+
+
+def utc_now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)  # naive, like the columns
+
+
+def enqueue_email(subject, body, to, from_email=FROM_EMAIL, subtype="html"):
+    # adds the email to the session: call `outbox.wake()` once it is committed
+    now = utc_now()
+    email = OutboundEmail(subject=subject, body=body, subtype=subtype, from_email=from_email, to=to,
+                          status="pending", attempts=0, next_attempt=now, created=now)
+    db.session.add(email)
+    return email
+
+
+def requeue_dead_emails():
+    # the dead letters are tried OUTBOX_MAX_ATTEMPTS times again; returns their number
+    requeued = db.session.execute(
+        db.update(OutboundEmail).where(OutboundEmail.status == "dead")
+        .values(status="pending", attempts=0, next_attempt=utc_now())
+    ).rowcount
+    db.session.commit()
+    return requeued
+
+
+class Outbox:
+
+    def __init__(self, app):
+        self.__app = app
+        self.__config = app.config
+        self.__thread = None
+        self.__lock = Lock()
+        self.__wakeup = Event()
+
+    def start(self):
+        # the dispatcher thread; started on first use, i.e. after gunicorn forks (threads do not survive a fork)
+        if self.__thread is not None or not self.__config["OUTBOX_DISPATCHER"]:
+            return None
+        with self.__lock:
+            if self.__thread is None:
+                self.__thread = Thread(target=self.__run, name="outbox-dispatcher", daemon=True)
+                self.__thread.start()
+
+    def wake(self):
+        # call after committing new emails: they are sent right away instead of at the next poll
+        self.start()
+        self.__wakeup.set()
+
+    def __run(self):
+        while True:
+            self.__wakeup.wait(self.__config["OUTBOX_POLL_INTERVAL"])
+            self.__wakeup.clear()
+            with self.__app.app_context():
+                try:
+                    while self.dispatch() == self.__config["OUTBOX_BATCH_SIZE"]:
+                        pass  # a full batch: more emails may be due
+                except Exception as error:
+                    # e.g. the DB is unreachable: the claimed emails are retried once their lease expires
+                    self.__app.logger.warning("Outbox dispatch failed: %s", error)
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+    def dispatch(self, connection=None):
+        # one batch: claims the due emails and sends them; returns the number of emails claimed
+        # - over the pool of the asyncio worker with MAIL_TRANSPORT = "aiosmtplib" (see `mail_worker.py`)
+        # - else over one Flask-Mailman connection (`connection`, or `mail.get_connection()`)
+        emails = self.__claim()
+        if not emails:
+            return 0
+        messages = []
+        for email in emails:
+            message = EmailMessage(subject=email.subject, body=email.body, from_email=email.from_email, to=[email.to])
+            message.content_subtype = email.subtype
+            messages.append(message)
+        try:
+            if connection is None and self.__config["MAIL_TRANSPORT"] == "aiosmtplib":
+                errors = mail_worker.send_many(messages)
+            else:
+                errors = self.__send_over(connection or mail.get_connection(), messages)
+        except Exception as error:
+            # e.g. no aiosmtplib, a dead mail worker: the batch is retried (then dead-lettered) like a failed send
+            errors = [error] * len(emails)
+        for email, error in zip(emails, errors):
+            if error is not None:
+                self.__fail(email, error)
+                continue
+            email.status = "sent"
+            email.attempts += 1
+            email.sent = utc_now()
+            email.claim = None
+        db.session.commit()
+        return len(emails)
+
+    @staticmethod
+    def __send_over(connection, messages):
+        # the exception of each message, None if sent
+        try:
+            connection.open()
+        except Exception as error:
+            return [error] * len(messages)
+        errors = []
+        try:
+            for message in messages:
+                message.connection = connection
+                try:
+                    message.send()
+                    errors.append(None)
+                except Exception as error:
+                    errors.append(error)
+        finally:
+            try:
+                connection.close()
+            except Exception:
+                pass  # the messages have been accepted (or not) already
+        return errors
+
+    def __claim(self):
+        # the due emails are leased to this batch for OUTBOX_LEASE seconds: the other dispatchers skip them
+        # (the conditional UPDATE lets only one dispatcher claim an email, without SKIP LOCKED)
+        now = utc_now()
+        claim = uuid4().hex
+        due = (
+            db.select(OutboundEmail.id)
+            .where(OutboundEmail.status == "pending", OutboundEmail.next_attempt <= now)
+            .order_by(OutboundEmail.next_attempt)
+            .limit(self.__config["OUTBOX_BATCH_SIZE"])
+        )
+        due_ids = db.session.execute(due).scalars().all()
+        if not due_ids:
+            db.session.commit()  # ends the read transaction
+            return []
+        db.session.execute(
+            db.update(OutboundEmail)
+            .where(OutboundEmail.id.in_(due_ids), OutboundEmail.status == "pending", OutboundEmail.next_attempt <= now)
+            .values(claim=claim, next_attempt=now + timedelta(seconds=self.__config["OUTBOX_LEASE"]))
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return db.session.execute(
+            db.select(OutboundEmail).where(OutboundEmail.claim == claim).order_by(OutboundEmail.id)
+        ).scalars().all()
+
+    def __fail(self, email, error):
+        email.attempts += 1
+        email.claim = None
+        email.last_error = f"{type(error).__name__}: {error}"[:1_000]
+        if email.attempts >= self.__config["OUTBOX_MAX_ATTEMPTS"]:
+            email.status = "dead"
+            return None
+        delay = self.__config["OUTBOX_RETRY_DELAY"] * 2 ** (email.attempts - 1)
+        email.next_attempt = utc_now() + timedelta(seconds=min(delay, self.__config["OUTBOX_MAX_RETRY_DELAY"]))
+
+
+outbox = Outbox(app)
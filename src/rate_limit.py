@@ -0,0 +1,130 @@
+# standard library
+from threading import Lock
+from time import monotonic, time
+
+# project
+from backends import LazyBackend, redis, redis_client
+from cache import LRUCache
+from config import app
+
+
+# RATE LIMITING: the unauthenticated routes costing a bcrypt hash or an email (RATE_LIMITS) take a token from a bucket
+# per client IP and, when the JSON body has an email, one per (normalized) email (`email` scope) or per client IP &
+# email (`ip_email` scope) as well; an empty bucket yields 429 with `Retry-After`; a bucket holds `burst` tokens and
+# regains `burst` tokens per `period` seconds
+# - `email`: shared by all the clients, i.e. anyone may exhaust it: fine for the routes sending an email to the address
+#   (registration, password reset), not for `/login` (a user would be locked out of their account by anyone knowing
+#   the address); `ip_email` bounds the guesses per client instead, the guesses spread over many IPs are not bounded
+#   (left to the bcrypt cost)
+# - `memory`: per worker (a client gets `burst` times the number of workers); `redis`: shared, atomic Lua scripts
+
+
+def normalize_email(email):
+    # one bucket for the variants of an address: case, surrounding spaces, `+tags` ("name+1@", "name+2@"...)
+    local_part, at, domain = email.strip().lower().rpartition("@")
+    if not at:
+        return domain
+    return f"{local_part.split('+', 1)[0]}@{domain}"
+
+
+class MemoryBackend:
+
+    def __init__(self, maxsize):
+        self.__buckets = LRUCache(maxsize)  # key: (tokens, updated); an evicted bucket is a full one
+        self.__lock = Lock()  # the read-modify-write of a bucket
+
+    def take(self, key, burst, rate):
+        # 0 if a token has been taken, else the seconds until one is available
+        now = monotonic()
+        with self.__lock:
+            tokens, updated = self.__buckets.get(key) or (burst, now)
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                self.__buckets.set(key, (tokens - 1, now))
+                return 0
+            self.__buckets.set(key, (tokens, now))
+            return (1 - tokens) / rate
+
+    def clear(self):
+        self.__buckets.clear()
+
+
+class RedisBackend:
+    # the same bucket as `MemoryBackend`, refilled and taken in one script: atomic across the workers & servers;
+    # the buckets expire once full again
+    # NOTE: the time is the web server's (`now`): keep the clocks of the servers in sync (NTP)
+
+    script = """
+    local burst, rate, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local tokens = tonumber(bucket[1]) or burst
+    local updated = tonumber(bucket[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+    local wait = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+    else
+        wait = (1 - tokens) / rate
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+    redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) / rate * 1000) + 1000)
+    return tostring(wait)
+    """  # a Lua number would be truncated to an integer in the reply
+
+    def __init__(self, url, prefix="ratelimit:", client=None):
+        self.__client = client or redis_client(url, "rate limit")
+        self.__take = self.__client.register_script(self.script)  # EVALSHA, loaded on first use
+        self.__prefix = prefix
+
+    def take(self, key, burst, rate):
+        try:
+            return float(self.__take(keys=[self.__prefix + key], args=[burst, rate, time()]))
+        except redis.RedisError:
+            return 0  # fails open: the limiter must not take the routes down with Redis
+
+    def clear(self):
+        try:
+            for key in self.__client.scan_iter(match=self.__prefix + "*", count=1_000):
+                self.__client.delete(key)
+        except redis.RedisError:
+            pass
+
+
+class RateLimiter(LazyBackend):
+
+    def __init__(self, config):
+        super().__init__()
+        self.__config = config
+
+    def _create_backend(self):
+        backend = self.__config["RATE_LIMIT_BACKEND"]
+        if backend == "memory":
+            return MemoryBackend(self.__config["RATE_LIMIT_MEMORY_SIZE"])
+        if backend == "redis":
+            return RedisBackend(self.__config["RATE_LIMIT_URL"])
+        raise ValueError(f"Unknown rate limit backend: {backend}")
+
+    def limits(self, endpoint):
+        # {"ip"/"email"/"ip_email": (burst, period)} of a rate limited route, or None
+        if not self.__config["RATE_LIMIT_ENABLED"]:
+            return None
+        return self.__config["RATE_LIMITS"].get(endpoint)
+
+    def check(self, endpoint, ip, email=None):
+        # None if the request may go on, else the seconds to wait; the IP bucket first: a client out of tokens
+        # does not drain the bucket of the email it tries
+        limits = self.limits(endpoint)
+        if not limits:
+            return None
+        ip_email = f"{ip}:{email}" if ip and email else None
+        for scope, subject in (("ip", ip), ("email", email), ("ip_email", ip_email)):
+            if scope not in limits or not subject:
+                continue
+            burst, period = limits[scope]
+            wait = self.backend.take(f"{endpoint}:{scope}:{subject}", burst, burst / period)
+            if wait:
+                return wait
+        return None
+
+
+rate_limiter = RateLimiter(app.config)
@@ -0,0 +1,277 @@
+# standard library
+import hashlib
+import hmac
+import os
+import shutil
+from datetime import datetime, timezone
+from time import time
+from urllib.parse import quote, urlsplit
+from uuid import uuid4
+from xml.etree import ElementTree
+
+# other 3rd party
+try:
+    import httpx  # optional; only needed by the "s3" backend
+except ImportError:
+    httpx = None
+
+# project
+from backends import LazyBackend
+from config import app, executor
+from images import blob_key, rendition_paths, remove_renditions, store_path
+
+
+# STORAGE: where the image store (see `images.py`) lives; the objects are addressed by keys like
+# `images/<key[:2]>/<key>_<rendition>.<extension>` and served from the URLs given by the backend, never by the workers:
+# - `local`: files under STATIC_FOLDER (one node, or a shared volume); the URL is the path, like the other static files
+# - `s3`: an S3-compatible bucket (AWS, MinIO...); the URLs are public (S3_PUBLIC_URL, e.g. a CDN) or presigned
+# the pictures uploaded before the store, and the default ones, stay single files of the static folder
+
+IMMUTABLE = "public, max-age=31536000, immutable"  # the content of a key never changes
+
+
+class StorageError(Exception):
+    pass
+
+
+class LocalStorage:
+
+    def __init__(self, folder):
+        self.__folder = folder
+
+    def path(self, key):
+        return os.path.join(self.__folder, key)
+
+    def put(self, key, source_path, content_type):
+        # moves the file in; renamed into place: a reader never gets a partial file, concurrent writers don't clash
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial_path = f"{path}.{uuid4().hex}.part"
+        try:
+            shutil.move(source_path, partial_path)
+            os.replace(partial_path, path)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def delete(self, key):
+        if os.path.exists(self.path(key)):
+            os.remove(self.path(key))
+
+    def url(self, key):
+        return self.path(key)
+
+    @property
+    def url_window(self):
+        return None  # the URLs never change
+
+
+class S3Storage:
+    # the S3 REST API over httpx, requests signed with AWS Signature Version 4
+    # NOTE: boto3 would bring botocore (~80 MB) for 5 calls; the signing is ~40 lines
+    # https://docs.aws.amazon.com/AmazonS3/latest/API/sig-v4-authenticating-requests.html
+
+    algorithm = "AWS4-HMAC-SHA256"
+    unsigned_payload = "UNSIGNED-PAYLOAD"
+    namespace = {"s3": "http://s3.amazonaws.com/doc/2006-03-01/"}
+
+    def __init__(self, endpoint_url, bucket, region, access_key_id, secret_access_key, public_url=None,
+                 url_expires=86_400, part_size=8 * 1024 * 1024, path_style=True, transport=None):
+        if httpx is None:
+            raise RuntimeError("The `httpx` package is required by the s3 storage backend")
+        endpoint = urlsplit(endpoint_url)
+        # path-style (MinIO & co.): `<endpoint>/<bucket>/<key>`; virtual-hosted (AWS): `<bucket>.<endpoint>/<key>`
+        self.__host = endpoint.netloc if path_style else f"{bucket}.{endpoint.netloc}"
+        self.__prefix = f"/{bucket}/" if path_style else "/"
+        self.__base_url = f"{endpoint.scheme}://{self.__host}"
+        self.__region = region
+        self.__access_key_id = access_key_id
+        self.__secret_access_key = secret_access_key
+        self.__public_url = public_url.rstrip("/") if public_url else None
+        self.__url_expires = url_expires
+        self.__part_size = part_size
+        self.__client = httpx.Client(base_url=self.__base_url, transport=transport, timeout=10)
+
+    # SIGNATURE V4
+
+    def __signing_key(self, day):
+        key = f"AWS4{self.__secret_access_key}".encode()
+        for message in (day, self.__region, "s3", "aws4_request"):
+            key = hmac.new(key, message.encode(), hashlib.sha256).digest()
+        return key
+
+    def __signature(self, method, path, query, headers, payload_hash, timestamp):
+        # (signed headers, signature); `headers` must include `host`
+        canonical_query = "&".join(
+            f"{quote(name, safe='-_.~')}={quote(value, safe='-_.~')}" for name, value in sorted(query.items())
+        )
+        canonical_headers = sorted((name.lower(), " ".join(str(value).split())) for name, value in headers.items())
+        signed_headers = ";".join(name for name, _ in canonical_headers)
+        canonical_request = "\n".join((
+            method, quote(path, safe="/-_.~"), canonical_query,
+            "".join(f"{name}:{value}\n" for name, value in canonical_headers), signed_headers, payload_hash
+        ))
+        day = timestamp[:8]
+        string_to_sign = "\n".join((
+            self.algorithm, timestamp, f"{day}/{self.__region}/s3/aws4_request",
+            hashlib.sha256(canonical_request.encode()).hexdigest()
+        ))
+        return signed_headers, hmac.new(self.__signing_key(day), string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+    def __request(self, method, key, query=None, content=b"", headers=None, expected=(200,)):
+        query = query or {}
+        timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        payload_hash = hashlib.sha256(content).hexdigest()
+        headers = {**(headers or {}), "host": self.__host, "x-amz-content-sha256": payload_hash, "x-amz-date": timestamp}
+        signed_headers, signature = self.__signature(method, self.__prefix + key, query, headers, payload_hash, timestamp)
+        headers["authorization"] = (
+            f"{self.algorithm} Credential={self.__access_key_id}/{timestamp[:8]}/{self.__region}/s3/aws4_request, "
+            f"SignedHeaders={signed_headers}, Signature={signature}"
+        )
+        try:
+            response = self.__client.request(method, quote(self.__prefix + key, safe="/-_.~"), params=query,
+                                             content=content, headers=headers)
+        except httpx.HTTPError as error:
+            raise StorageError(f"{method} {key}: {error}") from error
+        if response.status_code not in expected:
+            raise StorageError(f"{method} {key}: {response.status_code} {response.text[:200]}")
+        return response
+
+    # OBJECTS
+
+    def put(self, key, source_path, content_type):
+        # a single PUT up to `part_size`, a multipart upload above; removes the source
+        headers = {"content-type": content_type, "cache-control": IMMUTABLE}
+        if os.path.getsize(source_path) <= self.__part_size:
+            with open(source_path, "rb") as source:
+                self.__request("PUT", key, content=source.read(), headers=headers)
+        else:
+            self.__put_multipart(key, source_path, headers)
+        os.remove(source_path)
+
+    def __put_multipart(self, key, source_path, headers):
+        response = self.__request("POST", key, query={"uploads": ""}, headers=headers)
+        upload_id = ElementTree.fromstring(response.content).findtext("s3:UploadId", namespaces=self.namespace)
+        try:
+            parts = []
+            with open(source_path, "rb") as source:
+                while part := source.read(self.__part_size):
+                    number = str(len(parts) + 1)
+                    response = self.__request("PUT", key, query={"partNumber": number, "uploadId": upload_id}, content=part)
+                    parts.append(f"<Part><PartNumber>{number}</PartNumber><ETag>{response.headers['etag']}</ETag></Part>")
+            body = f"<CompleteMultipartUpload>{''.join(parts)}</CompleteMultipartUpload>".encode()
+            response = self.__request("POST", key, query={"uploadId": upload_id}, content=body)
+            if b"<Error>" in response.content:
+                raise StorageError(f"POST {key}: {response.text[:200]}")  # a failure may come with a 200
+        except StorageError:
+            try:
+                self.__request("DELETE", key, query={"uploadId": upload_id}, expected=(204,))  # frees the parts
+            except StorageError:
+                pass
+            raise
+
+    def exists(self, key):
+        return self.__request("HEAD", key, expected=(200, 404)).status_code == 200
+
+    def delete(self, key):
+        self.__request("DELETE", key, expected=(204, 200))
+
+    # URLS
+
+    @property
+    def url_window(self):
+        # presigned URLs are signed for the current window (half their lifetime), so they stay the same within it
+        # (the browsers cache the pictures) and are valid for at least half their lifetime; None for public URLs
+        if self.__public_url:
+            return None
+        seconds = self.__url_expires // 2
+        return datetime.fromtimestamp(time() // seconds * seconds, timezone.utc).replace(tzinfo=None)  # naive UTC
+
+    def url(self, key):
+        if self.__public_url:
+            return f"{self.__public_url}/{quote(key, safe='/-_.~')}"
+        return self.presigned_url(key, self.url_window)
+
+    def presigned_url(self, key, signed_at, expires=None):
+        # a GET URL valid for `expires` seconds (at most 7 days) from `signed_at`
+        timestamp = signed_at.strftime("%Y%m%dT%H%M%SZ")
+        query = {
+                 "X-Amz-Algorithm": self.algorithm,
+                 "X-Amz-Credential": f"{self.__access_key_id}/{timestamp[:8]}/{self.__region}/s3/aws4_request",
+                 "X-Amz-Date": timestamp,
+                 "X-Amz-Expires": str(expires or self.__url_expires),
+                 "X-Amz-SignedHeaders": "host",
+                 }
+        path = self.__prefix + key
+        _, signature = self.__signature("GET", path, query, {"host": self.__host}, self.unsigned_payload, timestamp)
+        query = "&".join(f"{name}={quote(value, safe='-_.~')}" for name, value in query.items())
+        return f"{self.__base_url}{quote(path, safe='/-_.~')}?{query}&X-Amz-Signature={signature}"
+
+
+class Storage(LazyBackend):
+
+    def __init__(self, config):
+        super().__init__()
+        self.__config = config
+
+    def _create_backend(self):
+        backend = self.__config["STORAGE_BACKEND"]
+        if backend == "local":
+            return LocalStorage(self.__config["STATIC_FOLDER"])
+        if backend == "s3":
+            return S3Storage(
+                self.__config["S3_ENDPOINT_URL"], self.__config["S3_BUCKET"], self.__config["S3_REGION"],
+                self.__config["S3_ACCESS_KEY_ID"], self.__config["S3_SECRET_ACCESS_KEY"],
+                public_url=self.__config["S3_PUBLIC_URL"], url_expires=self.__config["S3_URL_EXPIRES"],
+                part_size=self.__config["S3_PART_SIZE"], path_style=self.__config["S3_PATH_STYLE"]
+            )
+        raise ValueError(f"Unknown storage backend: {backend}")
+
+    def __getattr__(self, name):
+        # put(), exists(), delete(), url()...
+        return getattr(self.backend, name)
+
+
+storage = Storage(app.config)
+
+
+def image_urls(image):
+    # the `image`/`avatar` column -> rendition -> extension -> URL
+    key = blob_key(image)
+    if key is None:
+        return rendition_paths(image)  # a static file
+    return {
+        name: {extension: storage.url(path) for extension, path in extensions.items()}
+        for name, extensions in rendition_paths(store_path(key)).items()
+    }
+
+
+def image_url(image):
+    # the URL of the full JPEG
+    key = blob_key(image)
+    return image if key is None else storage.url(store_path(key))
+
+
+def remove_image(image):
+    # the files of a released picture (see `models.release_image()`); the objects are deleted in the background,
+    # only if the picture is still unreferenced by then (see `models.delete_unreferenced_image()`)
+    key = blob_key(image)
+    if key is None:
+        remove_renditions(image)  # a picture uploaded before the store
+        return None
+    return executor.submit(__delete_blob, key)
+
+
+def __delete_blob(key):
+    # EXECUTOR WORKS IN A SEPARATE THREAD
+    from models import delete_unreferenced_image  # `models` imports this module
+    paths = [path for extensions in rendition_paths(store_path(key)).values() for path in extensions.values()]
+
+    def delete_objects():
+        for path in paths:
+            storage.delete(path)
+
+    return delete_unreferenced_image(key, delete_objects)
@@ -0,0 +1,72 @@
+# flask 3rd party
+from flask import current_app, Request
+
+# project
+from images import InvalidImage, sniff_image
+
+
+# UPLOAD LIMITS: the picture routes get their own body size caps (UPLOAD_SIZE_LIMITS; MAX_CONTENT_LENGTH elsewhere):
+# werkzeug answers 413 before reading a body whose Content-Length is too large, or as soon as a chunked one exceeds it;
+# the files they receive are sniffed while being streamed in (see `SniffedImageStream`)
+
+
+class SniffedImageStream:
+    # the container the form parser writes a file into; nothing is kept until the first bytes prove to be the header
+    # of an admissible image (see `images.sniff_image()`): the rest of a rejected file is read, but discarded
+
+    def __init__(self, stream, max_pixels, sniff_limit):
+        self.__stream = stream
+        self.__max_pixels = max_pixels
+        self.__sniff_limit = sniff_limit
+        self.__prefix = b""
+        self.__accepted = False
+        self.__rejection = None
+
+    @property
+    def rejection(self):
+        # the reason why the file has been discarded (once the form is parsed), or None
+        if self.__accepted:
+            return None
+        return self.__rejection or "The file is not an image"  # the header has never been complete
+
+    def write(self, data):
+        if self.__accepted:
+            return self.__stream.write(data)
+        if self.__rejection is not None:
+            return len(data)
+        self.__prefix += data
+        try:
+            header = sniff_image(self.__prefix, self.__max_pixels)
+        except InvalidImage as error:
+            self.__reject(str(error))
+            return len(data)
+        if header is None:
+            if len(self.__prefix) >= self.__sniff_limit:
+                self.__reject("The file is not an image")
+            return len(data)
+        self.__accepted = True
+        self.__stream.write(self.__prefix)
+        self.__prefix = b""
+        return len(data)
+
+    def __reject(self, reason):
+        self.__rejection = reason
+        self.__prefix = b""
+
+    def __getattr__(self, name):
+        # read(), seek()... of the underlying (spooled) file
+        return getattr(self.__stream, name)
+
+
+class UploadRequest(Request):
+
+    @property
+    def max_content_length(self):
+        limit = current_app.config["UPLOAD_SIZE_LIMITS"].get(self.endpoint)
+        return limit if limit is not None else super().max_content_length
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        stream = super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        if self.endpoint not in current_app.config["UPLOAD_SIZE_LIMITS"]:
+            return stream
+        return SniffedImageStream(stream, current_app.config["IMAGE_MAX_PIXELS"], current_app.config["UPLOAD_SNIFF_BYTES"])
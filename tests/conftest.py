@@ -1,15 +1,22 @@
+import asyncio
 from os import environ, path
 from datetime import datetime, timedelta
+from hashlib import md5, sha256
+from io import BytesIO
 from shutil import rmtree
+from threading import Thread
 from uuid import uuid4
+from xml.etree import ElementTree
 #
+import httpx
+from PIL import Image
 from pytest import fixture
 
 # is testing, FLASK_ENV must be set to `test` to prevent loading prod settings in `config.py`
 # "FLASK_ENV" is set in `pytest.ini; `pip install pytest-env` is required for syntax construing`
 
 from config import app, bcrypt, db, SERVER_TIMEZONE
-from models import User, Van, Transaction, Review
+from models import User, Van, Transaction, Review, rebuild_rating_summaries
 import main  # import main to register all routes with the Flask app; the tests fail otherwise;
 
 
@@ -58,8 +65,9 @@ def test_app():
             lessee_email="mykie_mic@example.com",
             price=100,
             # remember that the earliest possible commencement day is the day of tomorrow
-            rent_commencement=(datetime.now(SERVER_TIMEZONE) + timedelta(days=1)).date(),
-            rent_expiration=(datetime.now(SERVER_TIMEZONE) + timedelta(days=3)).date(),
+            # NOTE: the tests book Van#1 from tomorrow on for 3 days; this period must not overlap theirs
+            rent_commencement=(datetime.now(SERVER_TIMEZONE) + timedelta(days=5)).date(),
+            rent_expiration=(datetime.now(SERVER_TIMEZONE) + timedelta(days=7)).date(),
             lessor_id=1,
             van_id=1
         )
@@ -77,6 +85,7 @@ def test_app():
         print("Adding table data...")
         db.session.add_all([test_user, test_van1, test_van2, test_van3, test_trx, test_review])
         db.session.commit()
+        rebuild_rating_summaries()  # the review above has not been posted through `/makeReview`
         print("Table data added.")
         yield app  # yield the app as a fixture; testing happens here;
         print("Closing up db session...")
@@ -102,3 +111,141 @@ def client(test_app):
 def runner(test_app):
     return test_app.test_cli_runner()
 
+
+@fixture
+def image_file():
+    # a real picture to upload: (file, file name)
+    def make_image_file(file_name="image.png", size=(2000, 1000), image_format="PNG", mode="RGB", exif=None):
+        stream = BytesIO()
+        image = Image.new(mode, size, (200, 120, 40, 128) if mode == "RGBA" else "orange")
+        image.save(stream, image_format, **({"exif": exif} if exif is not None else {}))
+        stream.seek(0)
+        return stream, file_name
+    return make_image_file
+
+
+class S3StandIn:
+    # an in-memory S3-compatible server (one bucket) for `httpx.MockTransport`: objects & multipart uploads;
+    # checks that each request is signed for its payload (the signature itself is checked against AWS' examples)
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.objects = {}  # key: (content, headers)
+        self.uploads = {}  # upload id: {part number: content}
+        self.requests = []  # (method, key, query)
+
+    def __call__(self, request):
+        bucket, _, key = request.url.path.lstrip("/").partition("/")
+        query = dict(request.url.params)
+        self.requests.append((request.method, key, query))
+        content = request.read()
+        if not request.headers.get("authorization", "").startswith("AWS4-HMAC-SHA256 Credential=") \
+                or request.headers.get("x-amz-content-sha256") != sha256(content).hexdigest():
+            return httpx.Response(403, text="<Error><Code>SignatureDoesNotMatch</Code></Error>")
+        if bucket != self.bucket:
+            return httpx.Response(404, text="<Error><Code>NoSuchBucket</Code></Error>")
+        if request.method == "POST" and "uploads" in query:
+            upload_id = uuid4().hex
+            self.uploads[upload_id] = {}
+            return httpx.Response(200, text=f'<InitiateMultipartUploadResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+                                            f'<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>')
+        if request.method == "PUT" and "uploadId" in query:
+            self.uploads[query["uploadId"]][int(query["partNumber"])] = content
+            return httpx.Response(200, headers={"etag": f'"{md5(content).hexdigest()}"'})
+        if request.method == "POST" and "uploadId" in query:
+            parts = self.uploads.pop(query["uploadId"])
+            numbers = [int(number.text) for number in ElementTree.fromstring(content).iter("PartNumber")]
+            self.objects[key] = (b"".join(parts[number] for number in numbers), {})
+            return httpx.Response(200, text="<CompleteMultipartUploadResult></CompleteMultipartUploadResult>")
+        if request.method == "DELETE" and "uploadId" in query:
+            self.uploads.pop(query["uploadId"], None)
+            return httpx.Response(204)
+        if request.method == "PUT":
+            self.objects[key] = (content, dict(request.headers))
+            return httpx.Response(200, headers={"etag": f'"{md5(content).hexdigest()}"'})
+        if key not in self.objects:
+            return httpx.Response(404 if request.method != "DELETE" else 204)
+        if request.method == "HEAD":
+            return httpx.Response(200)
+        if request.method == "GET":
+            return httpx.Response(200, content=self.objects[key][0])
+        if request.method == "DELETE":
+            del self.objects[key]
+            return httpx.Response(204)
+        return httpx.Response(405)
+
+
+@fixture
+def s3_server():
+    return S3StandIn("vans")
+
+
+class SMTPStandIn:
+    # a minimal SMTP server (no TLS, no AUTH) on an asyncio loop of its own; refuses the recipients "refused@..."
+
+    def __init__(self):
+        self.messages = []  # (sender, recipients, data)
+        self.connections = 0
+        self.writers = set()
+        self.loop = asyncio.new_event_loop()
+        Thread(target=self.loop.run_forever, daemon=True).start()
+        self.server = asyncio.run_coroutine_threadsafe(asyncio.start_server(self.handle, "127.0.0.1", 0), self.loop).result()
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        self.writers.add(writer)
+        writer.write(b"220 localhost ESMTP\r\n")
+        sender, recipients = None, []
+        while line := await reader.readline():
+            verb, _, argument = line.decode().strip().partition(" ")
+            address = argument.partition("<")[2].partition(">")[0]
+            verb = verb.upper()
+            if verb in ("EHLO", "HELO"):
+                writer.write(b"250-localhost\r\n250 8BITMIME\r\n")
+            elif verb == "MAIL":
+                sender, recipients = address, []
+                writer.write(b"250 OK\r\n")
+            elif verb == "RCPT" and address.startswith("refused@"):
+                writer.write(b"550 No such user\r\n")
+            elif verb == "RCPT":
+                recipients.append(address)
+                writer.write(b"250 OK\r\n")
+            elif verb == "DATA" and not recipients:
+                writer.write(b"503 No valid recipients\r\n")
+            elif verb == "DATA":
+                writer.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+                await writer.drain()
+                data = b""
+                while (line := await reader.readline()) != b".\r\n":
+                    data += line
+                self.messages.append((sender, recipients, data))
+                sender, recipients = None, []
+                writer.write(b"250 OK\r\n")
+            elif verb in ("RSET", "NOOP"):
+                sender, recipients = (None, []) if verb == "RSET" else (sender, recipients)
+                writer.write(b"250 OK\r\n")
+            elif verb == "QUIT":
+                writer.write(b"221 Bye\r\n")
+                break
+            else:
+                writer.write(b"502 Command not implemented\r\n")
+            await writer.drain()
+        self.writers.discard(writer)
+        writer.close()
+
+    def drop_connections(self):
+        # like a server closing the idle sessions
+        for writer in list(self.writers):
+            self.loop.call_soon_threadsafe(writer.close)
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.server.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+@fixture
+def smtp_server():
+    server = SMTPStandIn()
+    yield server
+    server.close()
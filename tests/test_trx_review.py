@@ -1,8 +1,17 @@
 
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from uuid import uuid4
 
-from config import SERVER_TIMEZONE
-from models import Van, Review
+import pytest
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateTable
+
+import main
+from availability import availability, BookedIntervals
+from config import app, db, SERVER_TIMEZONE
+from models import User, Van, Review, ReviewView, Transaction
 
 
 def test_make_trx(client):
@@ -219,6 +228,220 @@ def test_make_trx(client):
                            )
     assert response.status_code == 201
     assert response.json.get("message") == "Transaction created"
+    # the same period cannot be booked twice
+    response = client.post("/makeTransaction", 
+                           json={
+                               "vanUUID": van_uuid, 
+                               "lesseeName": "Jim", 
+                               "lesseeSurname": "Beam", 
+                               "lesseeEmail": "jim@example.com", 
+                               "rentCommencement": (datetime.now(SERVER_TIMEZONE) + timedelta(days=3)).date().isoformat(),
+                               "rentExpiration": (datetime.now(SERVER_TIMEZONE) + timedelta(days=6)).date().isoformat(),
+                               "price": 150
+                               }
+                           )
+    assert response.status_code == 409
+    assert response.json.get("message") == "The Van is not available for these dates"
+
+
+def test_make_trx_unknown_to_index(client):
+    # a booking made through another worker is not in this worker's index yet
+    van = Van.query.get(2)
+    assert not availability.get(van.id).overlaps(date(2100, 1, 1), date(2100, 1, 2))
+    other_worker_trx = Transaction(
+        uuid=uuid4(),
+        lessee_name="Other",
+        lessee_surname="Worker",
+        lessee_email="other@example.com",
+        price=van.price_per_day * 2,
+        rent_commencement=(datetime.now(SERVER_TIMEZONE) + timedelta(days=1)).date(),
+        rent_expiration=(datetime.now(SERVER_TIMEZONE) + timedelta(days=3)).date(),
+        lessor_id=van.host_id,
+        van_id=van.id
+    )
+    db.session.add(other_worker_trx)
+    db.session.commit()
+    assert not availability.get(van.id).overlaps(other_worker_trx.rent_commencement, other_worker_trx.rent_expiration)
+    # the DB has the final word
+    response = client.post("/makeTransaction", 
+                           json={
+                               "vanUUID": van.uuid, 
+                               "lesseeName": "Jim", 
+                               "lesseeSurname": "Beam", 
+                               "lesseeEmail": "jim@example.com", 
+                               "rentCommencement": (datetime.now(SERVER_TIMEZONE) + timedelta(days=2)).date().isoformat(),
+                               "rentExpiration": (datetime.now(SERVER_TIMEZONE) + timedelta(days=4)).date().isoformat(),
+                               "price": van.price_per_day * 2
+                               }
+                           )
+    assert response.status_code == 409
+    # ...and the index is refreshed
+    assert availability.get(van.id).overlaps(other_worker_trx.rent_commencement, other_worker_trx.rent_expiration)
+    # clean-up
+    db.session.delete(other_worker_trx)
+    db.session.commit()
+    availability.invalidate(van.id)
+
+
+def test_period_exclusion_constraint():
+    # declared on the model: `db.create_all()` databases have it too, on PostgreSQL only
+    exclusion = "EXCLUDE USING gist (van_id WITH =, daterange(rent_commencement, rent_expiration) WITH &&)"
+    assert exclusion in str(CreateTable(Transaction.__table__).compile(dialect=postgresql.dialect()))
+    assert "EXCLUDE" not in str(CreateTable(Transaction.__table__).compile(dialect=sqlite.dialect()))
+
+
+@pytest.mark.skipif(not app.config["SQLALCHEMY_DATABASE_URI"].startswith("postgresql"),
+                    reason="the exclusion constraint is PostgreSQL only")
+def test_make_trx_exclusion_constraint(client):
+    # the checks of the route are bypassed: the DB refuses the overlapping rent on its own
+    van = Van.query.get(2)
+    start = (datetime.now(SERVER_TIMEZONE) + timedelta(days=1)).date()
+
+    def rent(lessee, days):
+        return Transaction(uuid=uuid4(), lessee_name=lessee, lessee_surname="Overlap", lessee_email="overlap@example.com",
+                           price=van.price_per_day * 2, rent_commencement=start + timedelta(days=days),
+                           rent_expiration=start + timedelta(days=days + 2), lessor_id=van.host_id, van_id=van.id)
+
+    booked = rent("First", 0)
+    db.session.add(booked)
+    db.session.commit()
+    db.session.add(rent("Second", 1))
+    with pytest.raises(IntegrityError):
+        db.session.commit()
+    db.session.rollback()
+    db.session.add(rent("Adjacent", 2))  # half-open periods: the next rent may start on the day the previous one ends
+    db.session.commit()
+
+    class NoBookings:
+        def get(self, van_id):
+            return BookedIntervals([])
+
+        def invalidate(self, van_id):
+            pass
+
+    checks = main.availability, main.overlapping_transactions
+    main.availability = NoBookings()
+    main.overlapping_transactions = lambda van_id, start, end: Transaction.query.filter(db.false())
+    try:
+        response = client.post("/makeTransaction",
+                               json={
+                                   "vanUUID": van.uuid,
+                                   "lesseeName": "Jim",
+                                   "lesseeSurname": "Beam",
+                                   "lesseeEmail": "jim@example.com",
+                                   "rentCommencement": (start + timedelta(days=1)).isoformat(),
+                                   "rentExpiration": (start + timedelta(days=3)).isoformat(),
+                                   "price": van.price_per_day * 2
+                                   }
+                               )
+    finally:
+        main.availability, main.overlapping_transactions = checks
+    assert response.status_code == 409
+    assert response.json.get("statusText") == "Van not available"
+    # clean-up
+    Transaction.query.filter_by(lessee_surname="Overlap").delete()
+    db.session.commit()
+    availability.invalidate(van.id)
+
+
+def test_booked_intervals():
+    day = lambda number: date(2030, 1, number)
+    intervals = BookedIntervals([(day(10), day(12)), (day(1), day(3)), (day(3), day(5)), (day(20), day(20))])
+    # touching periods are merged; empty ones are ignored
+    assert list(zip(intervals.starts, intervals.ends)) == [(day(1), day(5)), (day(10), day(12))]
+    # half-open periods: a rent may commence on the expiration day of another one
+    assert not intervals.overlaps(day(5), day(10))
+    assert not intervals.overlaps(day(12), day(15))
+    assert intervals.overlaps(day(4), day(6))
+    assert intervals.overlaps(day(9), day(11))
+    assert intervals.overlaps(day(11), day(12))
+    assert intervals.overlaps(day(1), day(31))
+    # calendar ranges within a window
+    assert intervals.busy(day(2), day(11)) == [(day(2), day(5)), (day(10), day(11))]
+    assert intervals.free(day(2), day(15)) == [(day(5), day(10)), (day(12), day(15))]
+    # a booking ending on the clip point (e.g. today), a window clipped to nothing: no empty range
+    assert intervals.busy(day(5), day(8)) == []
+    assert intervals.busy(day(4), day(4)) == []
+    assert intervals.free(day(4), day(4)) == []
+    intervals.add(day(5), day(10))
+    assert intervals.free(day(1), day(15)) == [(day(12), day(15))]
+    assert len(intervals) == 1
+
+
+def test_van_availability(client):
+    # pre-requisites: Van#1 is booked for days +1..+4 (`test_make_trx`) and +5..+7 (`conftest.py`)
+    van1, van2, van3 = Van.query.get(1), Van.query.get(2), Van.query.get(3)
+    today = datetime.now(SERVER_TIMEZONE).date()
+    day = lambda number: (today + timedelta(days=number)).isoformat()
+    # bad van UUID
+    response = client.get(f"/vans/{wrong_van_UUID}/availability")
+    assert response.status_code == 404
+    # inadmissible windows
+    for query_string in ({"from": "2030-13-01"}, {"from": day(5), "to": day(5)}, {"from": day(0), "to": day(400)}):
+        response = client.get(f"/vans/{van1.uuid}/availability", query_string=query_string)
+        assert response.status_code == 400
+    response = client.get(f"/vans/{van1.uuid}/availability", query_string={"to": day(10)})
+    assert response.status_code == 200
+    assert response.json.get("availableFrom") == day(0)
+    assert response.json.get("busy") == [{"from": day(1), "to": day(4)}, {"from": day(5), "to": day(7)}]
+    assert response.json.get("free") == [
+        {"from": day(0), "to": day(1)}, {"from": day(4), "to": day(5)}, {"from": day(7), "to": day(10)}
+    ]
+    # the window clips the ranges; the past is cut off
+    response = client.get(f"/vans/{van1.uuid}/availability", query_string={"from": day(-3), "to": day(2)})
+    assert response.json.get("availableFrom") == day(0)
+    assert response.json.get("busy") == [{"from": day(1), "to": day(2)}]
+    # a window in the past is clipped to [today, today): no empty busy range, even around an ongoing rent
+    ongoing_trx = Transaction(uuid=uuid4(), lessee_name="Ongoing", lessee_surname="Rent", lessee_email="ongoing@example.com",
+                              price=van3.price_per_day * 3, rent_commencement=today - timedelta(days=2),
+                              rent_expiration=today + timedelta(days=1), lessor_id=van3.host_id, van_id=van3.id)
+    db.session.add(ongoing_trx)
+    db.session.commit()
+    availability.invalidate(van3.id)
+    try:
+        response = client.get(f"/vans/{van3.uuid}/availability", query_string={"from": day(-5), "to": day(-1)})
+        assert response.status_code == 200
+        assert response.json.get("busy") == []
+        assert response.json.get("free") == []
+    finally:
+        db.session.delete(ongoing_trx)
+        db.session.commit()
+        availability.invalidate(van3.id)
+    # the default window
+    response = client.get(f"/vans/{van3.uuid}/availability")
+    assert response.json.get("busy") == []
+    assert response.json.get("free") == [{"from": day(0), "to": day(app.config["AVAILABILITY_WINDOW_DAYS"])}]
+    # bulk variant
+    response = client.get("/vans/availability", query_string={"from": day(3), "to": day(5)})
+    assert response.status_code == 200
+    assert response.json.get("availableVans") == [str(van2.uuid), str(van3.uuid)]
+    response = client.get("/vans/availability", query_string={"from": day(4), "to": day(5)})
+    assert response.json.get("availableVans") == [str(van1.uuid), str(van2.uuid), str(van3.uuid)]
+    response = client.get("/vans/availability", query_string={"from": day(6), "to": day(9), "vans": f"{van1.uuid},{van3.uuid}"})
+    assert response.json.get("availableVans") == [str(van3.uuid)]
+    # the whole catalog: a single anti-join, the index is left alone
+    statements = []
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    availability.invalidate()
+    event.listen(db.engine, "before_cursor_execute", record_statement)
+    try:
+        response = client.get("/vans/availability", query_string={"from": day(3), "to": day(5)})
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record_statement)
+    assert response.json.get("availableVans") == [str(van2.uuid), str(van3.uuid)]
+    assert len(statements) == 1
+    assert "NOT (EXISTS" in statements[0]
+    # the listed vans are capped
+    too_many = ",".join(str(uuid4()) for _ in range(app.config["VANS_MAX_PAGE_SIZE"] + 1))
+    response = client.get("/vans/availability", query_string={"to": day(3), "vans": too_many})
+    assert response.status_code == 400
+    assert response.json.get("message") == "Too many vans requested"
+    # `to` is required; UUIDs must be valid
+    response = client.get("/vans/availability", query_string={"from": day(3)})
+    assert response.status_code == 400
+    response = client.get("/vans/availability", query_string={"to": day(3), "vans": "123"})
+    assert response.status_code == 400
 
 
 def test_make_review(client):
@@ -304,4 +527,130 @@ def test_make_review(client):
     assert len(van.reviews) == 2  # 1 review from `conftest.py`; another one - created;
 
 
+def test_rating_summaries(client, runner):
+    # pre-requisites: the reviews from `conftest.py` (4) and `test_make_review` (5)
+    van = Van.query.get(1)
+    host = User.query.get(1)
+    response = client.get(f"/vans/{van.uuid}")
+    assert response.json.get("van").get("rating") == {
+        "average": 4.5, "count": 2, "histogram": {"1": 0, "2": 0, "3": 0, "4": 1, "5": 1}
+    }
+    assert host.rating_count == 2 and host.rating_sum == 9
+    # deleting a review in the ADMIN panel updates the summaries
+    review = Review.query.filter_by(author="Jack Daniels").first()
+    with client.application.test_request_context():
+        assert ReviewView(Review, db.session).delete_model(review)
+    db.session.refresh(van)
+    db.session.refresh(host)
+    assert (van.rating_count, van.rating_sum, van.rating_5) == (1, 4, 0)
+    assert (host.rating_count, host.rating_sum, host.rating_5) == (1, 4, 0)
+    # a drift is fixed by rebuilding
+    van.rating_count = 100
+    db.session.commit()
+    result = runner.invoke(args=["rebuild-ratings"])
+    assert "Rating summaries rebuilt" in result.output
+    db.session.refresh(van)
+    assert (van.rating_count, van.rating_sum, van.rating_4) == (1, 4, 1)
+    # restore the deleted review for the tests below
+    response = client.post(
+        "/makeReview",
+        json={"vanUUID": van.uuid, "author": "Jack Daniels", "review": "I am no alchohol. The van was good.", "rating": 5}
+    )
+    assert response.status_code == 201
+
+
+def test_get_transactions(client):
+    # pre-requisites: the transaction from `conftest.py` and the one made in `test_make_trx`
+    JWT = client.post("/login", json={"email": "name.surname@example.com", "password": "12345678"}).json.get("JWToken")
+    headers = {"Authorization": f"Bearer {JWT}"}
+    # no Authorization header
+    response = client.get("/getTransactions")
+    assert response.status_code == 401
+    # inadmissible query parameters
+    oversized_cursor = getattr(main, "__encode_cursor")("2024-01-01", 10 ** 30)
+    for query_string in [{"from": "2024-13-01"}, {"limit": 0}, {"cursor": "abc"}, {"cursor": oversized_cursor}]:
+        response = client.get("/getTransactions", headers=headers, query_string=query_string)
+        assert response.status_code == 400
+        assert response.json.get("message") == "Invalid query parameters"
+    # first page: newest first
+    response = client.get("/getTransactions", headers=headers, query_string={"limit": 1})
+    assert response.status_code == 200
+    first_page = response.json.get("transactions")
+    assert [trx.get("lessee_name") for trx in first_page] == ["Jack"]
+    next_cursor = response.json.get("nextCursor")
+    assert next_cursor is not None
+    # last page
+    response = client.get("/getTransactions", headers=headers, query_string={"limit": 1, "cursor": next_cursor})
+    assert response.status_code == 200
+    assert [trx.get("lessee_name") for trx in response.json.get("transactions")] == ["Mike"]
+    assert response.json.get("nextCursor") is None
+    # date range
+    tomorrow = (datetime.now(SERVER_TIMEZONE) + timedelta(days=1)).date().isoformat()
+    response = client.get("/getTransactions", headers=headers, query_string={"from": tomorrow})
+    assert response.status_code == 200
+    assert response.json.get("transactions") == []
+    response = client.get("/getTransactions", headers=headers, query_string={"to": tomorrow})
+    assert len(response.json.get("transactions")) == 2
+
+
+def test_get_reviews(client):
+    # pre-requisites: the review from `conftest.py` and the one made in `test_make_review`
+    JWT = client.post("/login", json={"email": "name.surname@example.com", "password": "12345678"}).json.get("JWToken")
+    headers = {"Authorization": f"Bearer {JWT}"}
+    response = client.get("/getReviews", headers=headers)
+    assert response.status_code == 200
+    assert [review.get("author") for review in response.json.get("reviews")] == ["Jack Daniels", "Mike Michaels"]
+    assert response.json.get("nextCursor") is None
+    response = client.get("/getReviews", headers=headers, query_string={"limit": 1})
+    response = client.get("/getReviews", headers=headers, query_string={"limit": 1, "cursor": response.json.get("nextCursor")})
+    assert [review.get("author") for review in response.json.get("reviews")] == ["Mike Michaels"]
+    # the profile only counts them
+    logged_user = client.get("/getUser", headers=headers).json.get("logged_user")
+    assert logged_user.get("transactionsCount") == 2
+    assert logged_user.get("reviewsCount") == 2
+    assert "transactions" not in logged_user and "reviews" not in logged_user
+
+
+def test_income_stats(client):
+    # pre-requisites: the transactions from `conftest.py` (100) and `test_make_trx` (150), both made today
+    JWT = client.post("/login", json={"email": "name.surname@example.com", "password": "12345678"}).json.get("JWToken")
+    headers = {"Authorization": f"Bearer {JWT}"}
+    today = datetime.now(SERVER_TIMEZONE).date()
+    # no Authorization header
+    response = client.get("/host/stats/income")
+    assert response.status_code == 401
+    # inadmissible query parameters
+    response = client.get("/host/stats/income", headers=headers, query_string={"period": "week"})
+    assert response.status_code == 400
+    response = client.get("/host/stats/income", headers=headers, query_string={"from": "yesterday"})
+    assert response.status_code == 400
+    # monthly (default)
+    response = client.get("/host/stats/income", headers=headers)
+    assert response.status_code == 200
+    assert response.json.get("income") == [{"period": f"{today:%Y-%m}", "income": 250, "bookings": 2}]
+    assert response.json.get("totalIncome") == 250
+    assert response.json.get("totalBookings") == 2
+    # yearly
+    response = client.get("/host/stats/income", headers=headers, query_string={"period": "year"})
+    assert response.json.get("income") == [{"period": f"{today:%Y}", "income": 250, "bookings": 2}]
+    # date range
+    response = client.get("/host/stats/income", headers=headers, query_string={"to": (today - timedelta(days=1)).isoformat()})
+    assert response.json.get("income") == []
+    assert response.json.get("totalIncome") == 0
+
+
+def test_rating_stats(client):
+    # pre-requisites: the reviews from `conftest.py` (4) and `test_make_review` (5)
+    JWT = client.post("/login", json={"email": "name.surname@example.com", "password": "12345678"}).json.get("JWToken")
+    headers = {"Authorization": f"Bearer {JWT}"}
+    response = client.get("/host/stats/ratings", headers=headers)
+    assert response.status_code == 200
+    assert response.json.get("histogram") == {"1": 0, "2": 0, "3": 0, "4": 1, "5": 1}
+    assert response.json.get("count") == 2
+    assert response.json.get("average") == 4.5
+    response = client.get("/host/stats/ratings", headers=headers, query_string={"from": "2000-01-01", "to": "2000-12-31"})
+    assert response.json.get("count") == 0
+    assert response.json.get("average") is None
+
+
 wrong_van_UUID = "afcda8a9-cbc1-4d11-8381-c4a9ca4299e3"
@@ -1,13 +1,30 @@
 import os
+import re
 #
 from datetime import datetime, timedelta, timezone
 from io import BytesIO
+from smtplib import SMTPRecipientsRefused
+from time import sleep
 from uuid import uuid4
 
+import aiosmtplib
+import pytest
+import redis
+from flask import render_template
+from flask_jwt_extended import create_access_token, create_refresh_token, decode_token
+from flask_mailman import EmailMessage
 from freezegun import freeze_time
-
-from config import app, db
-from models import User
+from sqlalchemy import event
+
+import main
+from bloom import BloomFilter
+from config import app, bcrypt, db, executor
+from images import blob_key
+from mail_templates import MailTemplate, render_mail
+from mail_worker import MailWorker, mail_worker
+from models import ImageBlob, OutboundEmail, User
+from outbox import enqueue_email, outbox, requeue_dead_emails
+from rate_limit import MemoryBackend, RedisBackend, normalize_email, rate_limiter
 from main import __generate_reset_token
 
 
@@ -51,6 +68,47 @@ def test_register(client):
     response = client.post("/register", json=admissible_data)
     assert response.status_code == 201
     assert response.json.get("message") == "User registered"
+    # the email is queued with the user
+    email = OutboundEmail.query.filter_by(to=admissible_data["email"].lower()).one()
+    assert email.subject == "VanLife: Successful Registration"
+    assert email.status == "pending"
+
+
+def test_bloom_filter():
+    bloom_filter = BloomFilter(capacity=1_000, error_rate=0.01)
+    added = [f"user{i}@example.com" for i in range(1_000)]
+    for email in added:
+        bloom_filter.add(email)
+    # no false negatives
+    assert all(email in bloom_filter for email in added)
+    # false positives stay around the error rate
+    false_positives = sum(f"stranger{i}@example.com" in bloom_filter for i in range(10_000))
+    assert false_positives < 300
+
+
+def test_register_with_email_filter(client):
+    app.config["EMAIL_BLOOM_FILTER"] = True
+    main.__email_filter = None  # warm up on the next registration
+    try:
+        # the filter is warmed with the registered emails
+        response = client.post("/register", json=user_exists)
+        assert response.status_code == 400
+        assert response.json.get("message") == "This email is taken"
+        # new email
+        response = client.post("/register", json={**admissible_data, "email": "filtered@example.com"})
+        assert response.status_code == 201
+        assert "filtered@example.com" in main.__email_filter
+        response = client.post("/register", json={**admissible_data, "email": "filtered@example.com"})
+        assert response.status_code == 400
+        assert response.json.get("message") == "This email is taken"
+        # an email unknown to the filter (e.g. registered through another worker) is caught by the DB
+        main.__email_filter = BloomFilter(capacity=1_000)
+        response = client.post("/register", json={**admissible_data, "email": "filtered@example.com"})
+        assert response.status_code == 400
+        assert response.json.get("message") == "This email is taken"
+    finally:
+        app.config["EMAIL_BLOOM_FILTER"] = False
+        main.__email_filter = None
 
 
 def test_login(client):
@@ -61,6 +119,10 @@ def test_login(client):
     response = client.post("/login", json={})
     assert response.status_code == 400
     assert response.json.get("message") == "Required data missing"
+    # body over MAX_CONTENT_LENGTH
+    response = client.post("/login", json={"email": "a" * app.config["MAX_CONTENT_LENGTH"], "password": "12345678"})
+    assert response.status_code == 413
+    assert response.json.get("message") == "The request is too large"
     # No such user and wrong PW
     response = client.post("/login", json=no_user)
     assert response.status_code == 401
@@ -77,6 +139,145 @@ def test_login(client):
     assert response.json.get("RFToken", None) is not None
 
 
+def test_login_hashing_pool_saturated(client):
+    # occupy every slot of the hashing pool (the running and the queued jobs)
+    slots_number = app.config["BCRYPT_POOL_SIZE"] + app.config["BCRYPT_QUEUE_LIMIT"]
+    for _ in range(slots_number):
+        assert bcrypt._slots.acquire(blocking=False)
+    try:
+        response = client.post("/login", json={"email": "name.surname@example.com", "password": "12345678"})
+        assert response.status_code == 429
+        assert response.json.get("statusText") == "Too many requests"
+        assert response.headers.get("Retry-After") == "1"
+        response = client.post("/register", json={**admissible_data, "email": "busy@example.com"})
+        assert response.status_code == 429
+    finally:
+        for _ in range(slots_number):
+            bcrypt._slots.release()
+    # the slots are released after each job
+    response = client.post("/login", json={"email": "name.surname@example.com", "password": "12345678"})
+    assert response.status_code == 200
+    assert bcrypt.check_password_hash(bcrypt.generate_password_hash("secret"), "secret")
+    assert bcrypt._slots.acquire(blocking=False)  # the semaphore is not exhausted by the jobs above
+    bcrypt._slots.release()
+
+
+def test_bcrypt_calibration():
+    # a generous budget allows a higher cost
+    assert 4 <= bcrypt.calibrate(budget_ms=1, min_rounds=4) <= bcrypt.calibrate(budget_ms=2_000, min_rounds=4)
+    assert bcrypt.calibrate(budget_ms=1, min_rounds=10) == 10
+    # hashes below the current cost must be upgraded
+    assert bcrypt.needs_rehash(bcrypt.generate_password_hash("secret", rounds=4)) is (bcrypt.log_rounds > 4)
+    assert not bcrypt.needs_rehash(bcrypt.generate_password_hash("secret"))
+    assert not bcrypt.needs_rehash("not-a-bcrypt-hash")
+
+
+def test_login_upgrades_hash(client):
+    user = User.query.filter_by(email="name.surname@example.com").first()
+    assert user.password.startswith("$2b$04$")
+    bcrypt._log_rounds = 5  # raise the target cost
+    try:
+        response = client.post("/login", json={"email": "name.surname@example.com", "password": "12345678"})
+        assert response.status_code == 200
+        # the hash is upgraded in the background
+        for _ in range(50):
+            db.session.expire_all()
+            if user.password.startswith("$2b$05$"):
+                break
+            sleep(0.1)
+        assert user.password.startswith("$2b$05$")
+    finally:
+        bcrypt._log_rounds = app.config["BCRYPT_LOG_ROUNDS"]
+    # the password itself has not changed
+    response = client.post("/login", json={"email": "name.surname@example.com", "password": "12345678"})
+    assert response.status_code == 200
+
+
+def test_rate_limit(client):
+    # disabled in the tests: enabled here with small buckets
+    limits = app.config["RATE_LIMITS"]
+    app.config["RATE_LIMIT_ENABLED"] = True
+    app.config["RATE_LIMITS"] = {"login": {"ip": (3, 60), "ip_email": (2, 60)}, "register": {"email": (1, 60)}}
+    rate_limiter.use(MemoryBackend(100))
+    try:
+        # the IP & email bucket: two attempts, whatever the spelling of the address
+        for _ in range(2):
+            response = client.post("/login", json=no_user, environ_base={"REMOTE_ADDR": "10.0.0.1"})
+            assert response.status_code == 401
+        response = client.post("/login", json={**no_user, "email": " Dobby.Bi+2@GMAIL.com"},
+                               environ_base={"REMOTE_ADDR": "10.0.0.1"})
+        assert response.status_code == 429
+        assert response.json.get("statusText") == "Too many requests"
+        assert response.headers.get("Retry-After") == "30"  # 2 tokens per 60 seconds
+        # no lockout: the other clients may still log in as that user
+        response = client.post("/login", json=no_user, environ_base={"REMOTE_ADDR": "10.0.0.2"})
+        assert response.status_code == 401
+        # the IP bucket: empty after the third attempt, 429 for any email
+        response = client.post("/login", json={"email": "name.surname@example.com", "password": "12345678"},
+                               environ_base={"REMOTE_ADDR": "10.0.0.1"})
+        assert response.status_code == 429
+        assert response.headers.get("Retry-After") == "20"  # 3 tokens per 60 seconds
+        # the other clients and routes are not concerned
+        response = client.post("/login", json={"email": "name.surname@example.com", "password": "12345678"},
+                               environ_base={"REMOTE_ADDR": "10.0.0.3"})
+        assert response.status_code == 200
+        response = client.post("/register", json={}, environ_base={"REMOTE_ADDR": "10.0.0.1"})
+        assert response.status_code == 400
+        # the email bucket: shared by all the IPs
+        assert rate_limiter.check("register", "10.0.0.4", "dobby.bi@gmail.com") is None
+        assert 59 < rate_limiter.check("register", "10.0.0.5", "dobby.bi@gmail.com") <= 60
+        # disabled
+        app.config["RATE_LIMIT_ENABLED"] = False
+        response = client.post("/login", json=no_user, environ_base={"REMOTE_ADDR": "10.0.0.1"})
+        assert response.status_code == 401
+    finally:
+        app.config["RATE_LIMIT_ENABLED"] = False
+        app.config["RATE_LIMITS"] = limits
+        rate_limiter.use(None)
+    # the buckets refill over time
+    backend = MemoryBackend(100)
+    assert backend.take("key", 2, 100) == 0
+    assert backend.take("key", 2, 100) == 0
+    assert 0 < backend.take("key", 2, 100) <= 0.01
+    sleep(0.02)
+    assert backend.take("key", 2, 100) == 0
+    # the normalized emails
+    assert normalize_email(" Name.Surname+vans@Example.com ") == "name.surname@example.com"
+    assert normalize_email("name+a+b@example.com") == "name@example.com"
+    assert normalize_email("no-at-sign") == "no-at-sign"
+
+
+def test_rate_limit_redis():
+    # no Redis server in the tests: the script calls are checked against a stand-in client
+    class ScriptStandIn:
+        def __init__(self):
+            self.calls = []
+            self.replies = ["0", "12.5", redis.ConnectionError("unreachable")]
+
+        def __call__(self, keys, args):
+            self.calls.append((keys, args))
+            reply = self.replies.pop(0)
+            if isinstance(reply, Exception):
+                raise reply
+            return reply
+
+    class ClientStandIn:
+        def register_script(self, script):
+            self.script = script
+            self.take = ScriptStandIn()
+            return self.take
+
+    client = ClientStandIn()
+    backend = RedisBackend(None, client=client)
+    assert "HMGET" in client.script and "PEXPIRE" in client.script
+    assert backend.take("login:ip:10.0.0.1", 5, 0.5) == 0
+    assert backend.take("login:ip:10.0.0.1", 5, 0.5) == 12.5
+    keys, args = client.take.calls[-1]
+    assert keys == ["ratelimit:login:ip:10.0.0.1"]
+    assert args[:2] == [5, 0.5]
+    assert backend.take("login:ip:10.0.0.1", 5, 0.5) == 0  # fails open
+
+
 def test_get_user(client):
     # No Authorization Header
     response = client.get("/getUser", json={})
@@ -118,9 +319,177 @@ def test_send_reset_email(client):
     assert response.status_code == 400
     assert response.json.get("message") == "Email is not registred"
     # Success
+    mailbox = app.extensions["mailman"]  # the locmem backend's `outbox`
+    mailbox.outbox = []
     response = client.post("/sendReset", json={"email": "name.surname@example.com"})
     assert response.status_code == 200
     assert response.json.get("message") == "Email sent"
+    # queued; sent by the dispatcher (see `test_outbox`)
+    assert mailbox.outbox == []
+    email = OutboundEmail.query.filter_by(to="name.surname@example.com", subject="VanLife: Password Reset Requested").one()
+    assert email.status == "pending"
+    while outbox.dispatch():
+        pass
+    assert [message.to for message in mailbox.outbox if message.subject == "VanLife: Password Reset Requested"] == [["name.surname@example.com"]]
+    assert "/reset-password/" in mailbox.outbox[-1].body
+    assert mailbox.outbox[-1].content_subtype == "html"
+    db.session.expire_all()
+    assert email.status == "sent"
+
+
+def test_mail_templates(client):
+    # the same HTML as Jinja's, but for the collapsed whitespace
+    def collapsed(html):
+        return re.sub(r"\s+", " ", re.sub(r">\s+<", "><", html.strip()))
+    with app.test_request_context():
+        assert render_mail("mail/registration.html", name="Bob", surname="<Dillon>") == \
+            collapsed(render_template("mail/registration.html", name="Bob", surname="<Dillon>"))
+        reset_url = "https://example.com/reset-password/a.b-c?x=1&y=2"
+        assert render_mail("mail/change_email.html", reset_url=reset_url) == \
+            collapsed(render_template("mail/change_email.html", reset_url=reset_url))
+    assert "Dear user Bob &lt;Dillon&gt;!" in render_mail("mail/registration.html", name="Bob", surname="<Dillon>")
+    with pytest.raises(KeyError):
+        render_mail("mail/registration.html", name="Bob")
+    # plain substitution only
+    assert MailTemplate("<p>{{ a }}-{{b}}</p>").render(a=1, b="&") == "<p>1-&amp;</p>"
+    for source in ("{% if a %}{{ a }}{% endif %}", "{{ a|upper }}", "{# a #}"):
+        with pytest.raises(ValueError):
+            MailTemplate(source)
+
+
+def test_mail_worker(client, smtp_server):
+    # a pool of 2 connections to the stand-in server
+    worker = MailWorker({**app.config, "MAIL_SERVER": "127.0.0.1", "MAIL_PORT": smtp_server.port, "MAIL_USE_TLS": False,
+                         "MAIL_USE_SSL": False, "MAIL_USERNAME": None, "MAIL_PASSWORD": None, "MAIL_POOL_SIZE": 2})
+    def messages(recipients):
+        return [EmailMessage(subject="Subject", body="Body", from_email="vanlife@support.com", to=[to]) for to in recipients]
+    try:
+        # a batch is sent concurrently over the pool; a refused message does not end its session
+        errors = worker.send_many(messages([f"user{i}@example.com" for i in range(10)] + ["refused@example.com"]))
+        assert errors[:10] == [None] * 10
+        assert isinstance(errors[10], aiosmtplib.SMTPRecipientsRefused)
+        assert sorted(recipients[0] for _, recipients, _ in smtp_server.messages) == sorted(f"user{i}@example.com" for i in range(10))
+        assert smtp_server.connections == 2
+        # the connections are kept open for the next batches
+        assert worker.send_many(messages(["user10@example.com"])) == [None]
+        assert smtp_server.connections == 2
+        stats = worker.stats()
+        assert (stats["sent"], stats["failed"], stats["connectionsOpened"], stats["sentLastMinute"]) == (11, 1, 2, 11)
+        assert stats["latencyAvgMs"] > 0
+        assert stats["inFlight"] == 0
+        # the connections dropped by the server while idle are replaced
+        smtp_server.drop_connections()
+        sleep(0.1)
+        assert worker.send_many(messages(["user11@example.com"])) == [None]
+        assert smtp_server.connections == 3
+        assert smtp_server.messages[-1][1] == ["user11@example.com"]
+    finally:
+        worker.stop()
+    # the counters of the server's worker are behind the admin login
+    response = client.get("/admin/mailStats")
+    assert response.status_code == 302
+    with client.session_transaction() as session:
+        session["is_authorized"] = True
+    response = client.get("/admin/mailStats")
+    assert response.status_code == 200
+    assert response.json.get("sent") == 0
+    with client.session_transaction() as session:
+        session.pop("is_authorized")
+
+
+def test_outbox(client, runner):
+    class Connection:
+        # records the messages; refuses the recipients in `refused`
+        def __init__(self, refused=()):
+            self.refused = set(refused)
+            self.opened = 0
+            self.sent = []
+
+        def open(self):
+            self.opened += 1
+
+        def close(self):
+            pass
+
+        def send_messages(self, messages):
+            for message in messages:
+                if message.to[0] in self.refused:
+                    raise SMTPRecipientsRefused({message.to[0]: (550, b"No such user")})
+            self.sent.extend(messages)
+            return len(messages)
+
+    while outbox.dispatch():
+        pass  # the emails queued by the other tests
+    # a batch is sent over one connection
+    for i in range(3):
+        enqueue_email("Subject", "<p>Body</p>", f"user{i}@example.com")
+    enqueue_email("Subject", "Body", "refused@example.com", subtype="plain")
+    db.session.commit()
+    connection = Connection(refused=["refused@example.com"])
+    assert outbox.dispatch(connection) == 4
+    assert connection.opened == 1
+    assert [message.to for message in connection.sent] == [["user0@example.com"], ["user1@example.com"], ["user2@example.com"]]
+    assert outbox.dispatch(connection) == 0  # nothing due
+    # a failed email is retried after a delay, doubled after every failure, then dead-lettered
+    failed = OutboundEmail.query.filter_by(to="refused@example.com").one()
+    assert failed.status == "pending"
+    assert failed.attempts == 1
+    assert "SMTPRecipientsRefused" in failed.last_error
+    now = datetime.now(timezone.utc)
+    for attempt in range(2, app.config["OUTBOX_MAX_ATTEMPTS"] + 1):
+        delay = min(app.config["OUTBOX_RETRY_DELAY"] * 2 ** (attempt - 2), app.config["OUTBOX_MAX_RETRY_DELAY"])
+        with freeze_time(now + timedelta(seconds=delay - 1)):
+            assert outbox.dispatch(connection) == 0  # too early
+        now += timedelta(seconds=delay)
+        with freeze_time(now):
+            assert outbox.dispatch(connection) == 1
+    db.session.expire_all()
+    assert failed.status == "dead"
+    assert failed.attempts == app.config["OUTBOX_MAX_ATTEMPTS"]
+    with freeze_time(now + timedelta(days=1)):
+        assert outbox.dispatch(connection) == 0
+    # re-queued dead letters are tried again
+    assert requeue_dead_emails() == 1
+    assert outbox.dispatch(Connection()) == 1
+    db.session.expire_all()
+    assert failed.status == "sent"
+    # a claimed email is left to its dispatcher until the lease expires (e.g. the worker has been killed)
+    enqueue_email("Subject", "Body", "leased@example.com")
+    db.session.commit()
+    db.session.execute(db.update(OutboundEmail).where(OutboundEmail.to == "leased@example.com").values(
+        next_attempt=datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=app.config["OUTBOX_LEASE"])
+    ))
+    db.session.commit()
+    assert outbox.dispatch(connection) == 0
+    with freeze_time(datetime.now(timezone.utc) + timedelta(seconds=app.config["OUTBOX_LEASE"] + 1)):
+        assert outbox.dispatch(connection) == 1
+    # a failing transport (e.g. no aiosmtplib): the batch is retried, then dead-lettered, not leased again forever
+    def send_many(messages):
+        raise RuntimeError("The `aiosmtplib` package is required")
+    transport = app.config["MAIL_TRANSPORT"]
+    app.config["MAIL_TRANSPORT"] = "aiosmtplib"
+    mail_worker.send_many = send_many
+    try:
+        enqueue_email("Subject", "Body", "transport@example.com")
+        db.session.commit()
+        now = datetime.now(timezone.utc)
+        for attempt in range(1, app.config["OUTBOX_MAX_ATTEMPTS"] + 1):
+            with freeze_time(now):
+                assert outbox.dispatch() == 1
+            now += timedelta(seconds=app.config["OUTBOX_MAX_RETRY_DELAY"])
+        failed = OutboundEmail.query.filter_by(to="transport@example.com").one()
+        assert failed.status == "dead"
+        assert failed.attempts == app.config["OUTBOX_MAX_ATTEMPTS"]
+        assert failed.last_error == "RuntimeError: The `aiosmtplib` package is required"
+        with freeze_time(now + timedelta(days=1)):
+            assert outbox.dispatch() == 0
+    finally:
+        del mail_worker.send_many
+        app.config["MAIL_TRANSPORT"] = transport
+    # re-queued from the command line
+    result = runner.invoke(args=["requeue-emails"])
+    assert result.output == "1 dead-lettered emails re-queued\n"
+    assert outbox.dispatch(Connection()) == 1
 
 
 def test_validate_reset_token(client):
@@ -229,9 +598,26 @@ def test_refresh_JWT(client):
     assert response.json.get("logged_user", None) is not None
     logged_user = response.json.get("logged_user")
     assert logged_user.get("email") == "name.surname@example.com"
+    # the new tokens identify the user by id & uuid and carry the name as claims
+    user = User.query.filter_by(email="name.surname@example.com").first()
+    claims = decode_token(new_JWToken)
+    assert claims["sub"] == {"id": user.id, "uuid": str(user.uuid)}
+    assert (claims["name"], claims["surname"], claims["email"]) == ("Name", "Surname", "name.surname@example.com")
+    assert decode_token(RFToken)["sub"] == {"id": user.id, "uuid": str(user.uuid)}
+    # the refresh tokens issued with an email identity are still honoured; the new access token has an id identity
+    with app.app_context():
+        legacy_RFToken = create_refresh_token(identity={"email": "name.surname@example.com"})
+        unknown_RFToken = create_refresh_token(identity={"email": no_user["email"]})
+    response = client.post("/refreshToken", headers={"Authorization": f"Bearer {legacy_RFToken}"}, json={})
+    assert response.status_code == 200
+    assert decode_token(response.json.get("JWToken"))["sub"] == {"id": user.id, "uuid": str(user.uuid)}
+    # no such user (e.g. deleted)
+    response = client.post("/refreshToken", headers={"Authorization": f"Bearer {unknown_RFToken}"}, json={})
+    assert response.status_code == 401
+    assert response.json.get("JWToken", None) is None
 
 
-def test_upload_avatar(client):
+def test_upload_avatar(client, image_file):
     # pre-requisites
     user = User.query.filter_by(email="name.surname@example.com").first()
     response = client.post("/login", json={"email": user.email, "password": "12345678"})
@@ -282,7 +668,7 @@ def test_upload_avatar(client):
     )
     assert response.status_code == 400
     assert response.json.get("message") == "Extension: .png, .jp(e)g"
-    # Success
+    # not an image
     mock_file = (BytesIO(b"mocked-image"), "test.png")  # will be closed after each POST
     response = client.post(
         "/uploadAvatar",
@@ -290,14 +676,53 @@ def test_upload_avatar(client):
         data={"avatar": mock_file},
         content_type="multipart/form-data",
     )
-    assert response.status_code == 200
-    assert response.json.get("message") == "Profile picture updated"
+    assert response.status_code == 400
+    assert response.json.get("message") == "The file is not an image"
+    # Success
+    response = client.post(
+        "/uploadAvatar",
+        headers={"Authorization": f"Bearer {JWToken}"},
+        data={"avatar": image_file("test.jpg", size=(800, 800), image_format="JPEG")},
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 202
+    assert response.json.get("message") == "Profile picture uploaded"
+    # the renditions are made in the background
+    executor.futures.result(f"avatar:{user.uuid}", timeout=30)
+    db.session.expire_all()
 
-    # Verify file storage
+    # Verify file storage: the renditions are in the image store; the upload has been removed
     user_folder = os.path.join(app.config["STATIC_FOLDER"], "user", str(user.uuid))
-    saved_files = os.listdir(user_folder)
-    assert len(saved_files) == 1  # exactly one file is saved
-    assert saved_files[0].split(".")[-1] == "png"
+    assert os.listdir(user_folder) == []
+    avatar = User.query.filter_by(email="name.surname@example.com").first().avatar
+    avatar_path = os.path.join(app.config["STATIC_FOLDER"], avatar)  # the local storage
+    saved_files = os.listdir(os.path.dirname(avatar_path))
+    assert len(saved_files) == 6  # thumb, card & full; WebP & JPEG
+    assert os.path.basename(avatar) in saved_files
+    assert db.session.get(ImageBlob, blob_key(avatar)).refcount == 1
+    renditions = client.get("/getUser", headers={"Authorization": f"Bearer {JWToken}"}).json.get("logged_user").get("avatarRenditions")
+    assert renditions["full"]["jpeg"] == avatar_path
+    # the cached identities of the user are forgotten with the new avatar
+    main.__identity_cache.set("jti", main.CurrentIdentity(user.id, user.uuid, user.name, user.surname, user.email))
+    # a replaced picture shown by nobody else is freed
+    response = client.post(
+        "/uploadAvatar",
+        headers={"Authorization": f"Bearer {JWToken}"},
+        data={"avatar": image_file("test.jpg", size=(600, 800), image_format="JPEG")},
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 202
+    executor.futures.result(f"avatar:{user.uuid}", timeout=30)
+    db.session.expire_all()
+    assert User.query.filter_by(email="name.surname@example.com").first().avatar != avatar
+    assert main.__identity_cache.get("jti") is None
+    for _ in range(100):  # the files (and the row) are removed in the background
+        db.session.expire_all()
+        if not os.path.exists(avatar_path) and db.session.get(ImageBlob, blob_key(avatar)) is None:
+            break
+        sleep(0.1)
+    assert not os.path.exists(avatar_path)
+    assert db.session.get(ImageBlob, blob_key(avatar)) is None
 
     # ! Clean-up is in the `contest.py`'s test_app !
 
@@ -366,6 +791,51 @@ def test_update_user(client):
     db.session.commit()
 
 
+def test_identity_cache(client):
+    # pre-requisites
+    user = User.query.filter_by(email="name.surname@example.com").first()
+    JWToken = client.post("/login", json={"email": user.email, "password": "12345678"}).json.get("JWToken")
+    statements = []
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    def user_selects_on_add_van():
+        statements.clear()
+        event.listen(db.engine, "before_cursor_execute", record_statement)
+        try:
+            # authenticated, but fails on the validation: resolves the user only
+            response = client.post("/addVan", headers={"Authorization": f"Bearer {JWToken}"}, json={})
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record_statement)
+        assert response.status_code == 400
+        return [statement for statement in statements if 'FROM "user"' in statement or "FROM user" in statement]
+
+    # an id-identity token: the identity is read from the token's claims
+    main.__identity_cache.clear()
+    assert user_selects_on_add_van() == []
+    assert len(main.__identity_cache) == 0
+    # an email-identity token (issued before the id identities): resolved once, then cached under its `jti`
+    with app.app_context():
+        JWToken = create_access_token(identity={"email": user.email})
+    assert len(user_selects_on_add_van()) == 1
+    assert user_selects_on_add_van() == []
+    assert len(main.__identity_cache) == 1
+    # updating the user evicts the cached identity and returns a token with the new claims
+    response = client.patch(
+        "/updateUser",
+        headers={"Authorization": f"Bearer {JWToken}"},
+        json={"name": "Cached", "surname": "Identity"}
+    )
+    assert response.status_code == 200
+    assert len(main.__identity_cache) == 0
+    assert decode_token(response.json.get("JWToken"))["name"] == "Cached"
+    assert len(user_selects_on_add_van()) == 1
+    # re-write to the previous name
+    user.name = "Name"
+    user.surname = "Surname"
+    db.session.commit()
+
+
 def test_update_password(client):
     # pre-requisites
     user = User.query.filter_by(email="name.surname@example.com").first()